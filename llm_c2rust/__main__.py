@@ -32,6 +32,17 @@ if __name__ == "__main__":
         action="store_true",
         help="Enable node-centric method instead of edge-centric",
     )
+    parser.add_argument(
+        "--llm-cache",
+        default="/tmp/llm_cache.sqlite",
+        help="The cache file of LLM responses",
+    )
+    parser.add_argument(
+        "--no-cache",
+        default=False,
+        action="store_true",
+        help="Disable the cache of LLM responses",
+    )
     args = parser.parse_args()
 
     run(
@@ -42,4 +53,5 @@ if __name__ == "__main__":
         codeql=args.codeql,
         codeql_db=args.codeql_db,
         baseline=args.baseline,
+        llm_cache=None if args.no_cache else args.llm_cache,
     )
@@ -335,17 +335,27 @@ class RustSplittable(RustExtendable[RP]):
         Returns: 
             Self: a splittable piece that contains and only contains as many given pieces as possible.
         """
+        # ids of the pieces containing any given piece, the identity test of `contains`
+        containers: set[int] = set()
+        for piece in pieces_set:
+            parent = piece.parent
+            while parent is not None and id(parent) not in containers:
+                containers.add(id(parent))
+                parent = parent.parent
+        return self._trimmed(pieces_set, containers)
+
+    def _trimmed(self, pieces_set: set[RP], containers: set[int]) -> Self | None:
         p = self.empty_copy()
         for item in self.items:
             if item in pieces_set:
                 p.add(item.copy())
             elif isinstance(item, RustSplittable):
-                spl = item.trimmed(pieces)
+                spl = item._trimmed(pieces_set, containers)
                 if spl:
                     p.add(spl)
 
             elif isinstance(item, RustExtendable):
-                if any(item.contains(p) for p in pieces_set):
+                if id(item) in containers:
                     p.add(item.copy())
 
         return p if not p.is_empty() else None
@@ -148,9 +148,8 @@ class CppFileGraph(object):
     def has_main_function(self, file_path: str) -> bool:
         # Parse the file using parse_cpp to get the root of the Tree-sitter syntax tree
         try:
-            with open(
-                os.path.join(self.project_path, file_path), "r", encoding="utf-8"
-            ) as f:
+            # parsed as read, without decoding and encoding it again
+            with open(os.path.join(self.project_path, file_path), "rb") as f:
                 code = f.read()
             tree = parse_cpp(code)
         except Exception as e:
@@ -160,11 +159,7 @@ class CppFileGraph(object):
         def traverse_function_definition(node: Node) -> bool:
             out = False
             for child in node.children:
-                if (
-                    child.text is not None
-                    and child.type == "identifier"
-                    and child.text.decode("utf-8") == "main"
-                ):
+                if child.type == "identifier" and child.text == b"main":
                     return True
                 else:
                     out |= traverse_function_definition(child)
@@ -194,9 +189,8 @@ class CppFileGraph(object):
         """
         # Parse the file using parse_cpp to get the root of the Tree-sitter syntax tree
         try:
-            with open(
-                os.path.join(self.project_path, file_path), "r", encoding="utf-8"
-            ) as f:
+            # parsed as read, without decoding and encoding it again
+            with open(os.path.join(self.project_path, file_path), "rb") as f:
                 code = f.read()
             tree = parse_cpp(code)
         except Exception as e:
@@ -212,7 +206,7 @@ class CppFileGraph(object):
             if (
                 node.text is not None and node.type == "preproc_include"
             ):  # Assuming 'preproc_include' represents #include directives
-                include_text = node.text.decode("utf-8").strip()
+                include_text = node.text.decode("utf-8", errors="replace").strip()
 
                 # Extract the file path from the include directive
                 # Include directive format: #include "file.h" or #include <file.h>
@@ -14,6 +14,7 @@ from llm_c2rust.core.node_centric_engine import NodeCentricEngine
 from llm_c2rust.core.transpiler import ProjectTranspiler
 from llm_c2rust.core.utils import analyze_source
 from llm_c2rust.llm.api_inference import AsyncAPIInference
+from llm_c2rust.llm.response_cache import ResponseCache
 from llm_c2rust.utils.logging import enable_capture
 from llm_c2rust.segmenter.segmenter import SemanticSegmenter
 from llm_c2rust.utils.hash import calculate_md5
@@ -30,6 +31,7 @@ def run(
     codeql: str,
     codeql_db: str,
     baseline: bool = False,
+    llm_cache: str | None = None,
 ):
     method = "Edge-Centric" if baseline else "Node-Centric"
     __logger__.info(
@@ -58,6 +60,7 @@ def run(
             tpm=endpoint.tpm,
             default_max_tokens=endpoint.max_tokens,
             reasoning=endpoint.reasoning,
+            max_attempts=endpoint.max_attempts,
         )
 
     project_hash = calculate_md5(os.path.abspath(input_path))
@@ -72,6 +75,8 @@ def run(
 
     transpiler = ProjectTranspiler(input_path)
 
+    response_cache = ResponseCache(llm_cache) if llm_cache else None
+
     segmenter = SemanticSegmenter(database)
 
     if not baseline:
@@ -84,6 +89,8 @@ def run(
             0,
             config.max_retry,
             config.max_resolve_round,
+            config.max_concurrency,
+            response_cache,
         )
     else:
         engine = NodeCentricEngine(
@@ -93,6 +100,8 @@ def run(
             config.token_num_method,
             max_resolve_round=config.max_resolve_round,
             temperature=0,
+            max_concurrency=config.max_concurrency,
+            response_cache=response_cache,
         )
 
     asyncio.run(transpiler.transpile_project(engine, output_path))
@@ -108,10 +108,8 @@ def encode_cargo_config(cargo_config: CargoConfig) -> str:
 
 def write_cargo_config(cargo_config: CargoConfig, path: str):
 
-    cargo_dict: Dict = cargo_config.model_dump(exclude_none=True)
-
     with open(path, "w", encoding="utf-8") as file:
-        toml.dump(cargo_dict, file)
+        file.write(encode_cargo_config(cargo_config))
 
 
 def decode_cargo_config(toml_str: str) -> CargoConfig:
@@ -87,15 +87,16 @@ class CodeqlDatabase(object):
         if isinstance(query_results_path, Path):
             query_results_path = str(query_results_path)
 
-        for ql_file in os.listdir(queries_path):
-            if Path(ql_file).suffix != ".ql":
-                continue
-            basename = Path(os.path.basename(ql_file)).with_suffix("")
-            self.codeql_engine.bqrs_decode(
-                bqrs_file=Path(self.database_path)
-                / "results"
-                / pack
-                / f"{basename}.bqrs",
-                output_file=Path(query_results_path) / f"{basename}.json",
-                format="json",
-            )
+        with self.codeql_engine:
+            for ql_file in os.listdir(queries_path):
+                if Path(ql_file).suffix != ".ql":
+                    continue
+                basename = Path(os.path.basename(ql_file)).with_suffix("")
+                self.codeql_engine.bqrs_decode(
+                    bqrs_file=Path(self.database_path)
+                    / "results"
+                    / pack
+                    / f"{basename}.bqrs",
+                    output_file=Path(query_results_path) / f"{basename}.json",
+                    format="json",
+                )
@@ -1,7 +1,33 @@
+import asyncio
+import hashlib
+import inspect
+import json
 import logging
+import math
+import os
+import shutil
 import subprocess
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Literal, Optional, Tuple, Union
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 
 import logging
@@ -20,10 +46,862 @@ CodeqlSupportedLanguage = Literal[
 ]
 LanguageType = Union[CodeqlSupportedLanguage, List[CodeqlSupportedLanguage]]
 
+# value-independent flags shared by several subcommands
+_RERUN = "--rerun"
+_NO_RERUN = "--no-rerun"
+_DB_CLUSTER = "--db-cluster"
+_NO_GROUP_RESULTS = "--no-group-results"
+_NO_SARIF_MINIFY = "--no-sarif-minify"
+_SARIF_ADD_FILE_CONTENTS = "--sarif-add-file-contents"
+_NO_SARIF_ADD_FILE_CONTENTS = "--no-sarif-add-file-contents"
+_SARIF_ADD_SNIPPETS = "--sarif-add-snippets"
+_NO_SARIF_ADD_SNIPPETS = "--no-sarif-add-snippets"
+_FOLLOW_SYMLINKS = "--follow-symlinks"
+_NO_FOLLOW_SYMLINKS = "--no-follow-symlinks"
+
+_SUBCOMMANDS = (
+    "database create",
+    "database analyze",
+    "database cleanup",
+    "database finalize",
+    "database init",
+    "database index-files",
+    "database upgrade",
+    "database run-queries",
+    "bqrs decode",
+    "bqrs diff",
+    "bqrs hash",
+    "bqrs info",
+    "bqrs interpret",
+)
+
+# (enabled, disabled) spellings of the --[no-]x switches, keyed by the enabled one
+_TOGGLES: Dict[str, Tuple[str, str]] = {
+    _SARIF_ADD_FILE_CONTENTS: (_SARIF_ADD_FILE_CONTENTS, _NO_SARIF_ADD_FILE_CONTENTS),
+    _SARIF_ADD_SNIPPETS: (_SARIF_ADD_SNIPPETS, _NO_SARIF_ADD_SNIPPETS),
+    "--sarif-add-query-help": (
+        "--sarif-add-query-help",
+        "--no-sarif-add-query-help",
+    ),
+    "--sarif-group-rules-by-pack": (
+        "--sarif-group-rules-by-pack",
+        "--no-sarif-group-rules-by-pack",
+    ),
+    "--sarif-multicause-markdown": (
+        "--sarif-multicause-markdown",
+        "--no-sarif-multicause-markdown",
+    ),
+}
+
+
+def _codeql_env(threads: Optional[int], ram: Optional[int]) -> Optional[Dict[str, str]]:
+    """
+    Return the environment of a CodeQL process: the current environment, with
+    the thread and RAM defaults of the engine, or None to inherit it unchanged.
+
+    Traced builds (`database create --command`) need all of it.
+    """
+    overrides: Dict[str, str] = {}
+    if threads is not None:
+        overrides["CODEQL_THREADS"] = str(threads)
+    if ram is not None:
+        overrides["CODEQL_RAM"] = str(ram)
+    if not overrides:
+        return None
+    return {**os.environ, **overrides}
+
+
+# encoders used by the option tables below, each appends one option to argv
+def _flag(commands: List[str], flag: str, value: Any) -> None:
+    if value:
+        commands.append(flag)
+
+
+def _bool_pair(commands: List[str], flag: str, value: Optional[bool]) -> None:
+    if value is not None:
+        commands.append(_TOGGLES[flag][0 if value else 1])
+
+
+def _value(commands: List[str], flag: str, value: Any) -> None:
+    if value:
+        commands.extend([flag, str(value)])
+
+
+def _given(commands: List[str], flag: str, value: Any) -> None:
+    if value is not None:
+        commands.extend([flag, str(value)])
+
+
+def _joined(commands: List[str], flag: str, value: Optional[List[str]]) -> None:
+    if value:
+        commands.extend([flag, ",".join(value)])
+
+
+def _key_values(
+    commands: List[str], flag: str, value: Optional[List[Tuple[str, str]]]
+) -> None:
+    for key, val in value or ():
+        commands.extend([flag, f"{key}={val}"])
+
+
+_OptionTable = Tuple[Tuple[str, str, Callable[[List[str], str, Any], None]], ...]
+
+_BQRS_DECODE_OPTIONS: _OptionTable = (
+    ("--output", "output_file", _value),
+    ("--result-set", "result_set", _value),
+    ("--sort-key", "sort_key", _joined),
+    ("--sort-direction", "sort_direction", _joined),
+    ("--format", "format", _value),
+    ("--no-titles", "no_titles", _flag),
+    ("--entities", "entities", _joined),
+    ("--rows", "rows", _given),
+    ("--start-at", "start_at", _given),
+)
+
+_BQRS_DIFF_OPTIONS: _OptionTable = (
+    ("--left", "left", _value),
+    ("--right", "right", _value),
+    ("--both", "both", _value),
+    ("--retain-result-sets", "retain_result_sets", _value),
+    ("--compare-internal-ids", "compare_internal_ids", _flag),
+)
+
+_BQRS_INFO_OPTIONS: _OptionTable = (
+    ("--format", "format", _value),
+    ("--paginate-rows", "paginate_rows", _given),
+    ("--paginate-result-set", "paginate_result_set", _value),
+)
+
+_BQRS_INTERPRET_OPTIONS: _OptionTable = (
+    ("-t", "query_metadata", _key_values),
+    ("--max-paths", "max_paths", _value),
+    (_SARIF_ADD_FILE_CONTENTS, "sarif_add_file_contents", _bool_pair),
+    (_SARIF_ADD_SNIPPETS, "sarif_add_snippets", _bool_pair),
+    ("--sarif-add-query-help", "sarif_add_query_help", _bool_pair),
+    ("--sarif-include-query-help", "sarif_include_query_help", _given),
+    (
+        "--no-sarif-include-alert-provenance",
+        "no_sarif_include_alert_provenance",
+        _flag,
+    ),
+    ("--sarif-group-rules-by-pack", "sarif_group_rules_by_pack", _bool_pair),
+    ("--sarif-multicause-markdown", "sarif_multicause_markdown", _bool_pair),
+    (_NO_SARIF_MINIFY, "no_sarif_minify", _flag),
+    ("--sarif-run-property", "sarif_run_property", _key_values),
+    (_NO_GROUP_RESULTS, "no_group_results", _flag),
+    ("--csv-location-format", "csv_location_format", _value),
+    ("--dot-location-url-format", "dot_location_url_format", _value),
+    ("--sublanguage-file-coverage", "sublanguage_file_coverage", _flag),
+    ("--sarif-category", "sarif_category", _value),
+    ("-j", "threads", _value),
+    ("--column-kind", "column_kind", _value),
+    ("--source-archive", "source_archive", _value),
+    ("--source-location-prefix", "source_location_prefix", _value),
+)
+
+
+def _encode_options(
+    commands: List[str], table: _OptionTable, options: Dict[str, Any]
+) -> List[str]:
+    for flag, name, encode in table:
+        encode(commands, flag, options[name])
+    return commands
+
+
+# maximum number of memoized BQRS hashes and `bqrs info` outputs
+_HASH_CACHE_SIZE = 4096
+_INFO_CACHE_SIZE = 1024
+
+
+# formats whose output is a directory rather than a single file
+_DIRECTORY_FORMATS = ("graphtext", "dgml", "dot")
+
+
+def _copy_replace(src: str, dst: str) -> None:
+    """
+    Copies `src` to `dst` through a temporary file: `dst` is never seen half
+    written, and never shares its inode with `src`, so rewriting one of them
+    in place later cannot corrupt the other.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dst) or ".", prefix=".tmp-")
+    os.close(fd)
+    try:
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _restore_result(cached: str, output: str) -> bool:
+    """
+    Places a cached result at `output`, marking it as recently used.
+
+    :returns: Whether the result was cached.
+    :rtype: bool
+    """
+    if not os.path.isfile(cached):
+        return False
+    os.utime(cached)
+    _copy_replace(cached, output)
+    return True
+
+
+def _stat_or_none(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _bqrs_hash_key(file: Union[Path, str]) -> Tuple[str, int, int]:
+    path = os.path.abspath(file)
+    stat = os.stat(path)
+    return path, stat.st_mtime_ns, stat.st_size
+
+
+def _lru_get(cache: OrderedDict, key: Any) -> Any:
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+
+def _lru_put(cache: OrderedDict, key: Any, value: Any, size: int) -> Any:
+    cache[key] = value
+    if len(cache) > size:
+        cache.popitem(last=False)
+    return value
+
+
+# read buffer for the pipes of streamed CodeQL output
+_PIPE_BUFSIZE = 1 << 14
+# number of trailing output lines kept for CalledProcessError
+_TAIL_LINES = 100
+
+
+def _log_raw(level: int, raw: bytes, tail: Deque[bytes]) -> None:
+    # output lines are only decoded when they are actually logged
+    tail.append(raw)
+    if logger.isEnabledFor(level):
+        line = raw.decode(errors="replace").rstrip()
+        if line:
+            logger.log(level, "%s", line)
+
+
+def _join_tail(tail: Deque[bytes]) -> str:
+    return b"".join(tail).decode(errors="replace")
+
+
+# commands longer than this pass their options through an @argfile
+_ARGFILE_THRESHOLD = 32
+
+
+@contextmanager
+def _argfile(commands: List[str]) -> Iterator[List[str]]:
+    """
+    Yields the argv to spawn for a command, moving everything after
+    `codeql <group> <verb>` into a temporary @argfile when the command is long.
+    """
+    if len(commands) <= _ARGFILE_THRESHOLD:
+        yield commands
+        return
+    fd, path = tempfile.mkstemp(suffix=".args")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            for arg in commands[3:]:
+                escaped = arg.replace("\\", "\\\\").replace('"', '\\"')
+                f.write(f'"{escaped}"\n')
+        yield [*commands[:3], "@" + path]
+    finally:
+        os.remove(path)
+
+
+def _log_elapsed(commands: List[str], start_ns: int, returncode: int) -> None:
+    elapsed_ms = (time.perf_counter_ns() - start_ns) / 1e6
+    logger.debug(
+        "codeql %s: exit=%s elapsed_ms=%.1f",
+        " ".join(commands[1:3]),
+        returncode,
+        elapsed_ms,
+    )
+
+
+def _forward(pipe: IO[bytes], level: int, tail: Deque[bytes]) -> None:
+    for raw in pipe:
+        _log_raw(level, raw, tail)
+
+
+async def _pump(stream: asyncio.StreamReader, level: int, tail: Deque[bytes]) -> None:
+    async for raw in stream:
+        _log_raw(level, raw, tail)
+
+
+def _merge_analyze_outputs(format: str, shards: List[str], output: str) -> None:
+    """
+    Merges the outputs of batched `database analyze` runs into one file.
+    """
+    if format == "csv":
+        with open(output, "wb") as out:
+            for shard in shards:
+                with open(shard, "rb") as f:
+                    out.write(f.read())
+    else:
+        merged = None
+        for shard in shards:
+            with open(shard, "r", encoding="utf-8") as f:
+                sarif = json.load(f)
+            if merged is None:
+                merged = sarif
+            else:
+                merged["runs"].extend(sarif["runs"])
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(merged, f)
+
+
+def _remove_shards(shards: List[str]) -> None:
+    # also called after a failed batch, when some shards were never written
+    for shard in shards:
+        try:
+            os.remove(shard)
+        except FileNotFoundError:
+            pass
+
 
 class CodeqlEngine(object):
-    def __init__(self, codeql_bin: str) -> None:
-        self.codeql_bin: str = codeql_bin
+    def __init__(
+        self,
+        codeql_bin: str,
+        threads: Optional[int] = None,
+        ram: Optional[int] = None,
+        cache_dir: Optional[Union[Path, str]] = None,
+        cache_size: int = 1 << 30,
+    ) -> None:
+        """
+        :param codeql_bin: Path of the CodeQL executable.
+        :type codeql_bin: str
+        :param threads: Default number of threads for CodeQL commands, passed as `CODEQL_THREADS`.
+        :type threads: Optional[int]
+        :param ram: Default RAM limit in MB for CodeQL commands, passed as `CODEQL_RAM`.
+        :type ram: Optional[int]
+        :param cache_dir: Directory caching the outputs of `bqrs decode` and `bqrs interpret` by the stable hash of their input, disabled if None.
+        :type cache_dir: Optional[Union[Path, str]]
+        :param cache_size: Maximum total size in bytes of the cached outputs.
+        :type cache_size: int
+        """
+        # an absolute path lets subprocess use posix_spawn without a PATH lookup
+        self.codeql_bin: str = shutil.which(codeql_bin) or codeql_bin
+        self.threads: Optional[int] = threads
+        self.ram: Optional[int] = ram
+        # argv prefixes of the wrapped subcommands, built once per engine
+        self._prefixes: Dict[str, Tuple[str, ...]] = {
+            subcommand: (self.codeql_bin, *subcommand.split())
+            for subcommand in _SUBCOMMANDS
+        }
+        self.cache_dir: Optional[str] = (
+            None if cache_dir is None else os.path.abspath(cache_dir)
+        )
+        self.cache_size: int = cache_size
+        self._server: Optional[subprocess.Popen] = None
+        # BQRS stable hashes keyed by (path, mtime, size), oldest first
+        self._hash_cache: OrderedDict[Tuple[str, int, int], str] = OrderedDict()
+        # raw `bqrs info` outputs keyed by the BQRS file key and the options;
+        # text, so callers get a fresh parse they are free to modify
+        self._info_cache: OrderedDict[Tuple[Any, ...], str] = OrderedDict()
+        self._server_lock = threading.Lock()
+        # set in the threads of `_fan_out`, which spawn their own processes
+        # rather than queue up behind the single server
+        self._local = threading.local()
+        self._context_lock = threading.Lock()
+        self._context_depth = 0
+        self._context_started = False
+        # total size of the cached results, scanned on the first store
+        self._cache_total: Optional[int] = None
+        self._cache_lock = threading.Lock()
+
+    @property
+    def _env(self) -> Optional[Dict[str, str]]:
+        # taken at every spawn, so changes to os.environ are seen
+        return _codeql_env(self.threads, self.ram)
+
+    def __enter__(self) -> "CodeqlEngine":
+        # reentrant: only the outermost context stops the server, and only if
+        # it started it, so a server started by the caller is left running
+        with self._context_lock:
+            if self._context_depth == 0:
+                self._context_started = self._server is None
+                self.start_server()
+            self._context_depth += 1
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        with self._context_lock:
+            self._context_depth -= 1
+            if self._context_depth == 0 and self._context_started:
+                self.stop_server()
+
+    def start_server(self) -> None:
+        """
+        Starts a persistent `codeql execute cli-server`, which then runs the
+        short-lived `bqrs` subcommands so that JVM startup is paid only once.
+        Commands are spawned one by one as before if the server cannot start.
+        """
+        if self._server is not None:
+            return
+        try:
+            server = subprocess.Popen(
+                [self.codeql_bin, "execute", "cli-server"],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                env=self._env,
+                close_fds=False,
+            )
+        except OSError as e:
+            logger.warning(f"Cannot start CodeQL CLI server: {e}")
+            return
+        assert server.stderr is not None
+        threading.Thread(
+            target=_forward,
+            args=(server.stderr, logging.INFO, deque(maxlen=_TAIL_LINES)),
+            daemon=True,
+        ).start()
+        self._server = server
+
+    def stop_server(self) -> None:
+        """
+        Shuts down the CodeQL CLI server if it is running.
+        """
+        with self._server_lock:
+            server, self._server = self._server, None
+        if server is None:
+            return
+        assert server.stdin is not None
+        try:
+            server.stdin.write(json.dumps(["shutdown"]).encode() + b"\0")
+            server.stdin.close()
+            server.wait(timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            server.kill()
+            server.wait()
+
+    def _request_server(self, commands: List[str]) -> Optional[str]:
+        """
+        Runs a command in the CodeQL CLI server.
+
+        :returns: The standard output of the command, or None if no server is running or the calling thread bypasses it.
+        :rtype: Optional[str]
+
+        :raises subprocess.CalledProcessError: If the server dies while running the command.
+        """
+        if getattr(self._local, "bypass_server", False):
+            return None
+        with self._server_lock:
+            server = self._server
+            if server is None:
+                return None
+            assert server.stdin is not None and server.stdout is not None
+            chunks: List[bytes] = []
+            try:
+                # requests are JSON argument arrays without the executable,
+                # and responses are terminated with a NUL byte
+                server.stdin.write(json.dumps(commands[1:]).encode() + b"\0")
+                server.stdin.flush()
+                while not (chunks and chunks[-1].endswith(b"\0")):
+                    chunk = server.stdout.read1(_PIPE_BUFSIZE)
+                    if not chunk:
+                        raise BrokenPipeError()
+                    chunks.append(chunk)
+            except OSError:
+                self._server = None
+                server.kill()
+                returncode = server.wait()
+                logger.error(
+                    f"CodeQL exited with code {returncode}: {' '.join(commands)}"
+                )
+                raise subprocess.CalledProcessError(
+                    returncode, commands, b"".join(chunks).decode(errors="replace")
+                )
+        return b"".join(chunks)[:-1].decode(errors="replace")
+
+    def _run_short(
+        self,
+        commands: List[str],
+        capture: bool = False,
+        outputs: Sequence[Optional[Union[Path, str]]] = (),
+    ) -> str:
+        """
+        Runs a short-lived CodeQL command, in the CLI server if one is running.
+
+        The server does not report the exit status of a command, so a command
+        that shows no sign of success there (no captured output, or an output
+        file not written) is run again in its own process, whose exit status
+        is checked. A command with neither is never sent to the server.
+
+        :param capture: Whether to return the output instead of logging it.
+        :type capture: bool
+        :param outputs: The files the command writes.
+        :type outputs: Sequence[Optional[Union[Path, str]]]
+
+        :returns: The standard output of the command if captured, otherwise an empty string.
+        :rtype: str
+
+        :raises subprocess.CalledProcessError: If the command fails.
+        """
+        paths = [os.fspath(o) for o in outputs if o is not None]
+        before = [_stat_or_none(path) for path in paths]
+        # without either, nothing would tell a failure in the server apart
+        output = self._request_server(commands) if capture or paths else None
+        if output is not None:
+            # a directory may be written into without its own stat changing
+            written = all(
+                (after := _stat_or_none(path)) is not None
+                and (after != stat or os.path.isdir(path))
+                for path, stat in zip(paths, before)
+            )
+            if not written or (capture and not output.strip()):
+                logger.warning(
+                    f"CodeQL CLI server gave no result, running on its own: {' '.join(commands)}"
+                )
+                output = None
+        if output is None:
+            if capture:
+                return self._run_captured(commands)
+            self._run(commands)
+            return ""
+        if capture:
+            return output
+        if logger.isEnabledFor(logging.INFO):
+            for line in output.splitlines():
+                if line:
+                    logger.info("%s", line)
+        return ""
+
+    def _run(self, commands: List[str]) -> None:
+        """
+        Runs a CodeQL command to completion, logging its output line by line
+        while it is produced instead of buffering it.
+
+        :raises subprocess.CalledProcessError: If the command exits with a non-zero code.
+        """
+        start_ns = time.perf_counter_ns()
+        with _argfile(commands) as argv:
+            proc = subprocess.Popen(
+                argv,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                bufsize=_PIPE_BUFSIZE,
+                env=self._env,
+                close_fds=False,
+            )
+            assert proc.stdout is not None and proc.stderr is not None
+            stdout: Deque[bytes] = deque(maxlen=_TAIL_LINES)
+            stderr: Deque[bytes] = deque(maxlen=_TAIL_LINES)
+            readers = [
+                threading.Thread(
+                    target=_forward, args=(proc.stdout, logging.INFO, stdout)
+                ),
+                threading.Thread(
+                    target=_forward, args=(proc.stderr, logging.INFO, stderr)
+                ),
+            ]
+            for reader in readers:
+                reader.start()
+            returncode = proc.wait()
+            for reader in readers:
+                reader.join()
+            proc.stdout.close()
+            proc.stderr.close()
+        _log_elapsed(commands, start_ns, returncode)
+        if returncode != 0:
+            logger.error(f"CodeQL exited with code {returncode}: {' '.join(commands)}")
+            raise subprocess.CalledProcessError(
+                returncode, commands, _join_tail(stdout), _join_tail(stderr)
+            )
+
+    def _run_captured(self, commands: List[str]) -> str:
+        """
+        Runs a CodeQL command with small output and returns its standard output.
+
+        :raises subprocess.CalledProcessError: If the command exits with a non-zero code.
+        """
+        start_ns = time.perf_counter_ns()
+        with _argfile(commands) as argv:
+            result = subprocess.run(
+                argv,
+                text=True,
+                capture_output=True,
+                env=self._env,
+                close_fds=False,
+            )
+        _log_elapsed(commands, start_ns, result.returncode)
+        result.check_returncode()
+        return result.stdout
+
+    async def _arun(self, commands: List[str]) -> None:
+        """
+        Async version of :meth:`_run`, which does not block the event loop.
+
+        :raises subprocess.CalledProcessError: If the command exits with a non-zero code.
+        """
+        start_ns = time.perf_counter_ns()
+        with _argfile(commands) as argv:
+            proc = await asyncio.create_subprocess_exec(
+                *argv,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                limit=_PIPE_BUFSIZE,
+                env=self._env,
+                close_fds=False,
+            )
+            assert proc.stdout is not None and proc.stderr is not None
+            stdout: Deque[bytes] = deque(maxlen=_TAIL_LINES)
+            stderr: Deque[bytes] = deque(maxlen=_TAIL_LINES)
+            await asyncio.gather(
+                _pump(proc.stdout, logging.INFO, stdout),
+                _pump(proc.stderr, logging.INFO, stderr),
+            )
+            returncode = await proc.wait()
+        _log_elapsed(commands, start_ns, returncode)
+        if returncode != 0:
+            logger.error(f"CodeQL exited with code {returncode}: {' '.join(commands)}")
+            raise subprocess.CalledProcessError(
+                returncode, commands, _join_tail(stdout), _join_tail(stderr)
+            )
+
+    async def _arun_captured(self, commands: List[str]) -> str:
+        """
+        Async version of :meth:`_run_captured`.
+
+        :raises subprocess.CalledProcessError: If the command exits with a non-zero code.
+        """
+        start_ns = time.perf_counter_ns()
+        with _argfile(commands) as argv:
+            proc = await asyncio.create_subprocess_exec(
+                *argv,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                env=self._env,
+                close_fds=False,
+            )
+            stdout, stderr = await proc.communicate()
+        _log_elapsed(commands, start_ns, proc.returncode or 0)
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(
+                proc.returncode or 0,
+                commands,
+                stdout.decode(errors="replace"),
+                stderr.decode(errors="replace"),
+            )
+        return stdout.decode(errors="replace")
+
+    def _result_cache_entry(
+        self,
+        builder: Callable[..., List[str]],
+        output_param: str,
+        args: Tuple[Any, ...],
+        kwargs: Dict[str, Any],
+    ) -> Optional[Tuple[str, str, Dict[str, Any]]]:
+        """
+        :returns: The BQRS file, the output file and the other options of a cacheable decode/interpret call, or None if its result should not be cached.
+        :rtype: Optional[Tuple[str, str, Dict[str, Any]]]
+        """
+        if self.cache_dir is None:
+            return None
+        bound = inspect.signature(builder).bind(*args, **kwargs)
+        bound.apply_defaults()
+        options = dict(bound.arguments)
+        bqrs_file = options.pop("bqrs_file")
+        output = options.pop(output_param)
+        if output is None or options["format"] in _DIRECTORY_FORMATS:
+            return None
+        return os.fspath(bqrs_file), os.fspath(output), options
+
+    def _result_cache_path(self, bqrs_hash: str, options: Dict[str, Any]) -> str:
+        assert self.cache_dir is not None
+        key = bqrs_hash + repr(sorted(options.items()))
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest[2:], options["format"])
+
+    def _store_result(self, output: str, cached: str) -> None:
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        with self._cache_lock:
+            if self._cache_total is None:
+                self._cache_total = self._evict_results()
+            if os.path.isfile(cached):
+                self._cache_total -= os.path.getsize(cached)
+            _copy_replace(output, cached)
+            self._cache_total += os.path.getsize(cached)
+            # the cache is only scanned when the running total goes over, and
+            # then emptied down to 90%, so that the next stores do not scan it
+            if self._cache_total > self.cache_size:
+                self._cache_total = self._evict_results(self.cache_size * 9 // 10)
+
+    def _evict_results(self, target: Optional[int] = None) -> int:
+        """
+        Removes the least recently used results until the cache fits in `target`.
+
+        :param target: The size in bytes to fit in, `cache_size` if None.
+        :type target: Optional[int]
+
+        :returns: The total size of the remaining results.
+        :rtype: int
+        """
+        assert self.cache_dir is not None
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        if target is None:
+            target = self.cache_size
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            os.remove(path)
+            total -= size
+        return total
+
+    def _run_cached(
+        self,
+        builder: Callable[..., List[str]],
+        output_param: str,
+        *args: Any,
+        **kwargs: Any,
+    ) -> None:
+        """
+        Runs a decode/interpret command, reusing its output from the result
+        cache when the same BQRS contents were processed with the same options.
+        """
+        commands = builder(*args, **kwargs)
+        entry = self._result_cache_entry(builder, output_param, args, kwargs)
+        if entry is None:
+            bound = inspect.signature(builder).bind(*args, **kwargs)
+            self._run_short(commands, outputs=(bound.arguments.get(output_param),))
+            return
+        bqrs_file, output, options = entry
+        cached = self._result_cache_path(self.bqrs_hash(bqrs_file), options)
+        if _restore_result(cached, output):
+            logger.info(f"Reusing cached result {cached} for {output}")
+            return
+        self._run_short(commands, outputs=(output,))
+        self._store_result(output, cached)
+
+    async def _arun_cached(
+        self,
+        builder: Callable[..., List[str]],
+        output_param: str,
+        *args: Any,
+        **kwargs: Any,
+    ) -> None:
+        """
+        Async version of :meth:`_run_cached`.
+        """
+        commands = builder(*args, **kwargs)
+        entry = self._result_cache_entry(builder, output_param, args, kwargs)
+        if entry is None:
+            await self._arun(commands)
+            return
+        bqrs_file, output, options = entry
+        cached = self._result_cache_path(await self.abqrs_hash(bqrs_file), options)
+        if _restore_result(cached, output):
+            logger.info(f"Reusing cached result {cached} for {output}")
+            return
+        await self._arun(commands)
+        self._store_result(output, cached)
+
+    def _output_in(
+        self,
+        builder: Callable[..., List[str]],
+        output_param: str,
+        args: Tuple[Any, ...],
+        kwargs: Dict[str, Any],
+    ) -> Optional[inspect.BoundArguments]:
+        """
+        :returns: The bound arguments of a call that has no output path and
+            should return its output instead, or None.
+        :rtype: Optional[inspect.BoundArguments]
+        """
+        bound = inspect.signature(builder).bind(*args, **kwargs)
+        bound.apply_defaults()
+        if bound.arguments[output_param] is not None:
+            return None
+        if bound.arguments["format"] in _DIRECTORY_FORMATS:
+            raise ValueError(
+                f"Cannot return {bound.arguments['format']} output, which is a directory"
+            )
+        return bound
+
+    def _run_or_read(
+        self,
+        builder: Callable[..., List[str]],
+        output_param: str,
+        *args: Any,
+        **kwargs: Any,
+    ) -> Optional[bytes]:
+        """
+        Runs :meth:`_run_cached`, or when no output path is given, runs it into
+        a temporary file and returns the file contents.
+        """
+        bound = self._output_in(builder, output_param, args, kwargs)
+        if bound is None:
+            self._run_cached(builder, output_param, *args, **kwargs)
+            return None
+        with tempfile.TemporaryDirectory() as tmp:
+            bound.arguments[output_param] = output = os.path.join(tmp, "output")
+            self._run_cached(builder, output_param, *bound.args, **bound.kwargs)
+            with open(output, "rb") as f:
+                return f.read()
+
+    async def _arun_or_read(
+        self,
+        builder: Callable[..., List[str]],
+        output_param: str,
+        *args: Any,
+        **kwargs: Any,
+    ) -> Optional[bytes]:
+        """
+        Async version of :meth:`_run_or_read`.
+        """
+        bound = self._output_in(builder, output_param, args, kwargs)
+        if bound is None:
+            await self._arun_cached(builder, output_param, *args, **kwargs)
+            return None
+        with tempfile.TemporaryDirectory() as tmp:
+            bound.arguments[output_param] = output = os.path.join(tmp, "output")
+            await self._arun_cached(builder, output_param, *bound.args, **bound.kwargs)
+            with open(output, "rb") as f:
+                return f.read()
+
+    def _fan_out(
+        self,
+        fn: Callable[[Any], None],
+        items: List[Any],
+        max_workers: Optional[int],
+    ) -> None:
+        """
+        Calls `fn` on every item from a thread pool. Each call blocks on its own
+        CodeQL process, so threads are enough to keep all cores busy; the CLI
+        server is bypassed since it runs one command at a time. The first
+        failure is raised once every item has been processed.
+        """
+
+        def call(item: Any) -> None:
+            self._local.bypass_server = True
+            try:
+                fn(item)
+            finally:
+                self._local.bypass_server = False
+
+        with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+            futures = [executor.submit(call, item) for item in items]
+        errors = [e for future in futures if (e := future.exception())]
+        if errors:
+            raise errors[0]
 
     def database_create(
         self,
@@ -61,10 +939,38 @@ class CodeqlEngine(object):
         :notes: For additional details, please refer to:
                 https://docs.github.com/zh/code-security/codeql-cli/getting-started-with-the-codeql-cli/preparing-your-code-for-codeql-analysis
         """
-        if isinstance(database_path, Path):
-            database_path = str(database_path)
-        if isinstance(source_root, Path):
-            source_root = str(source_root)
+        self._run(
+            self._database_create_commands(
+                database_path=database_path,
+                source_root=source_root,
+                language=language,
+                command=command,
+                build_mode=build_mode,
+                db_cluster=db_cluster,
+                no_run_unnecessary_builds=no_run_unnecessary_builds,
+                codescanning_config=codescanning_config,
+            )
+        )
+
+    async def adatabase_create(self, *args: Any, **kwargs: Any) -> None:
+        """
+        Async version of :meth:`database_create`.
+        """
+        await self._arun(self._database_create_commands(*args, **kwargs))
+
+    def _database_create_commands(
+        self,
+        database_path: Union[Path, str],
+        source_root: Union[Path, str],
+        language: LanguageType = "c-cpp",
+        command: Optional[Union[str, List[str]]] = None,
+        build_mode: Optional[Literal["none", "autobuild", "manual"]] = None,
+        db_cluster: bool = False,
+        no_run_unnecessary_builds: bool = False,
+        codescanning_config: Optional[str] = None,
+    ) -> List[str]:
+        database_path = os.fspath(database_path)
+        source_root = os.fspath(source_root)
 
         if isinstance(language, list) or isinstance(language, tuple):
             language_str = ",".join(language)
@@ -72,9 +978,7 @@ class CodeqlEngine(object):
             language_str = language
 
         commands = [
-            self.codeql_bin,
-            "database",
-            "create",
+            *self._prefixes["database create"],
             database_path,
             "--language=" + language_str,
             "--source-root",
@@ -91,7 +995,7 @@ class CodeqlEngine(object):
             commands.extend(["--build-mode", build_mode])
 
         if db_cluster:
-            commands.append("--db-cluster")
+            commands.append(_DB_CLUSTER)
 
         if no_run_unnecessary_builds:
             commands.append("--no-run-unnecessary-builds")
@@ -99,22 +1003,7 @@ class CodeqlEngine(object):
         if codescanning_config:
             commands.extend(["--codescanning-config", codescanning_config])
 
-        # Run the command
-        codeql_results = subprocess.run(
-            commands,
-            text=True,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        if codeql_results.returncode == 0:
-            log_fn = logger.info
-        else:
-            log_fn = logger.error
-        if codeql_results.stdout:
-            log_fn(codeql_results.stdout)
-        if codeql_results.stderr:
-            log_fn(codeql_results.stderr)
+        return commands
 
     def database_analyze(
         self,
@@ -142,6 +1031,7 @@ class CodeqlEngine(object):
             Literal["uri", "line-column", "offset-length"]
         ] = "line-column",
         dot_location_url_format: Optional[str] = None,
+        query_batch_size: Optional[int] = None,
     ) -> None:
         """
         Analyzes a CodeQL database using specified queries and formats the results.
@@ -172,22 +1062,174 @@ class CodeqlEngine(object):
         :type csv_location_format: Optional[str]
         :param dot_location_url_format: Format for location URLs in DOT output (default is None).
         :type dot_location_url_format: Optional[str]
+        :param query_batch_size: If set, the queries are split into batches of at most this size, which are analyzed by concurrent CodeQL processes and merged into `output`. Only CSV and SARIF formats can be merged.
+        :type query_batch_size: Optional[int]
 
         :raises subprocess.CalledProcessError: If the analysis process encounters an error.
 
         :notes: For more information, please refer to:
                 https://docs.github.com/zh/code-security/codeql-cli/getting-started-with-the-codeql-cli/analyzing-your-code-with-codeql-queries
         """
-        if isinstance(database_path, Path):
-            database_path = str(database_path)
-        if isinstance(output, Path):
-            output = str(output)
+        batches, shards = self._database_analyze_batches(
+            database_path=database_path,
+            queries=queries,
+            format=format,
+            output=output,
+            rerun=rerun,
+            max_paths=max_paths,
+            sarif_add_file_contents=sarif_add_file_contents,
+            sarif_add_snippets=sarif_add_snippets,
+            sarif_include_query_help=sarif_include_query_help,
+            no_group_results=no_group_results,
+            no_sarif_minify=no_sarif_minify,
+            csv_location_format=csv_location_format,
+            dot_location_url_format=dot_location_url_format,
+            query_batch_size=query_batch_size,
+        )
+        try:
+            if len(batches) == 1:
+                self._run(batches[0])
+                return
+            with ThreadPoolExecutor(max_workers=len(batches)) as executor:
+                futures = [executor.submit(self._run, batch) for batch in batches]
+            errors = [e for future in futures if (e := future.exception())]
+            if errors:
+                raise errors[0]
+            _merge_analyze_outputs(format, shards, os.fspath(output))
+        finally:
+            _remove_shards(shards)
+
+    async def adatabase_analyze(
+        self,
+        database_path: Union[Path, str],
+        queries: List[str],
+        format: Literal[
+            "csv",
+            "sarif-latest",
+            "sarifv2.1.0",
+            "graphtext",
+            "dgml",
+            "dot",
+        ],
+        output: Union[Path, str],
+        rerun: bool = True,
+        max_paths: Optional[int] = 4,
+        sarif_add_file_contents: bool = False,
+        sarif_add_snippets: bool = True,
+        sarif_include_query_help: Literal[
+            "always", "custom_queries_only", "never"
+        ] = "custom_queries_only",
+        no_group_results: bool = False,
+        no_sarif_minify: bool = False,
+        csv_location_format: Optional[
+            Literal["uri", "line-column", "offset-length"]
+        ] = "line-column",
+        dot_location_url_format: Optional[str] = None,
+        query_batch_size: Optional[int] = None,
+    ) -> None:
+        """
+        Async version of :meth:`database_analyze`.
+        """
+        batches, shards = self._database_analyze_batches(
+            database_path=database_path,
+            queries=queries,
+            format=format,
+            output=output,
+            rerun=rerun,
+            max_paths=max_paths,
+            sarif_add_file_contents=sarif_add_file_contents,
+            sarif_add_snippets=sarif_add_snippets,
+            sarif_include_query_help=sarif_include_query_help,
+            no_group_results=no_group_results,
+            no_sarif_minify=no_sarif_minify,
+            csv_location_format=csv_location_format,
+            dot_location_url_format=dot_location_url_format,
+            query_batch_size=query_batch_size,
+        )
+        try:
+            results = await asyncio.gather(
+                *(self._arun(commands) for commands in batches),
+                return_exceptions=True,
+            )
+            errors = [e for e in results if isinstance(e, BaseException)]
+            if errors:
+                raise errors[0]
+            if shards:
+                _merge_analyze_outputs(format, shards, os.fspath(output))
+        finally:
+            _remove_shards(shards)
+
+    def _database_analyze_batches(
+        self, query_batch_size: Optional[int] = None, **arguments: Any
+    ) -> Tuple[List[List[str]], List[str]]:
+        """
+        Splits a `database analyze` invocation into one command per batch of
+        queries, each writing to its own shard of the output.
+
+        :returns: The commands to run, and the shards to merge into the requested output, empty if the queries are not split.
+        :rtype: Tuple[List[List[str]], List[str]]
+        """
+        queries: List[str] = list(arguments["queries"])
+        if not query_batch_size or len(queries) <= query_batch_size:
+            return [self._database_analyze_commands(**arguments)], []
+
+        format = arguments["format"]
+        if format not in ("csv", "sarif-latest", "sarifv2.1.0"):
+            raise ValueError(
+                f"Cannot merge batched analysis results of format {format}"
+            )
+
+        output = os.fspath(arguments["output"])
+        batch_num = math.ceil(len(queries) / query_batch_size)
+        threads = max(1, (os.cpu_count() or 1) // batch_num)
+        root, ext = os.path.splitext(output)
+        shards: List[str] = []
+        batches: List[List[str]] = []
+        for i in range(batch_num):
+            shard = f"{root}.chunk{i}{ext}"
+            shards.append(shard)
+            batch = arguments | {
+                "queries": queries[i * query_batch_size : (i + 1) * query_batch_size],
+                "output": shard,
+                "threads": threads,
+            }
+            batches.append(self._database_analyze_commands(**batch))
+        return batches, shards
+
+    def _database_analyze_commands(
+        self,
+        database_path: Union[Path, str],
+        queries: List[str],
+        format: Literal[
+            "csv",
+            "sarif-latest",
+            "sarifv2.1.0",
+            "graphtext",
+            "dgml",
+            "dot",
+        ],
+        output: Union[Path, str],
+        rerun: bool = True,
+        max_paths: Optional[int] = 4,
+        sarif_add_file_contents: bool = False,
+        sarif_add_snippets: bool = True,
+        sarif_include_query_help: Literal[
+            "always", "custom_queries_only", "never"
+        ] = "custom_queries_only",
+        no_group_results: bool = False,
+        no_sarif_minify: bool = False,
+        csv_location_format: Optional[
+            Literal["uri", "line-column", "offset-length"]
+        ] = "line-column",
+        dot_location_url_format: Optional[str] = None,
+        threads: Optional[int] = None,
+    ) -> List[str]:
+        database_path = os.fspath(database_path)
+        output = os.fspath(output)
 
         # Prepare the base command
         commands = [
-            self.codeql_bin,
-            "database",
-            "analyze",
+            *self._prefixes["database analyze"],
             database_path,
             "--format=" + format,
             "--output=" + output,
@@ -198,55 +1240,39 @@ class CodeqlEngine(object):
             commands.append(query)
 
         # Add optional flags and arguments
-        if not rerun:
-            commands.append("--no-rerun")
-        else:
-            commands.append("--rerun")
+        commands.append(_RERUN if rerun else _NO_RERUN)
 
         if max_paths is not None:
-            commands.append(f"--max-paths={max_paths}")
-
-        if sarif_add_file_contents:
-            commands.append("--sarif-add-file-contents")
-        else:
-            commands.append("--no-sarif-add-file-contents")
+            commands.extend(["--max-paths", str(max_paths)])
 
-        if not sarif_add_snippets:
-            commands.append("--no-sarif-add-snippets")
-        else:
-            commands.append("--sarif-add-snippets")
+        commands.append(
+            _SARIF_ADD_FILE_CONTENTS
+            if sarif_add_file_contents
+            else _NO_SARIF_ADD_FILE_CONTENTS
+        )
+        commands.append(
+            _SARIF_ADD_SNIPPETS if sarif_add_snippets else _NO_SARIF_ADD_SNIPPETS
+        )
 
         if sarif_include_query_help:
-            commands.append(f"--sarif-include-query-help={sarif_include_query_help}")
+            commands.extend(["--sarif-include-query-help", sarif_include_query_help])
 
         if no_group_results:
-            commands.append("--no-group-results")
+            commands.append(_NO_GROUP_RESULTS)
 
         if no_sarif_minify:
-            commands.append("--no-sarif-minify")
+            commands.append(_NO_SARIF_MINIFY)
 
         if csv_location_format:
-            commands.append(f"--csv-location-format={csv_location_format}")
+            commands.extend(["--csv-location-format", csv_location_format])
 
         if dot_location_url_format:
-            commands.append(f"--dot-location-url-format={dot_location_url_format}")
-
-        # Run the command
-        codeql_results = subprocess.run(
-            commands,
-            text=True,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        if codeql_results.returncode == 0:
-            log_fn = logger.info
-        else:
-            log_fn = logger.error
-        if codeql_results.stdout:
-            log_fn(codeql_results.stdout)
-        if codeql_results.stderr:
-            log_fn(codeql_results.stderr)
+            commands.extend(["--dot-location-url-format", dot_location_url_format])
+
+        if threads is not None:
+            commands.extend(["--threads", str(threads)])
+
+        return commands
 
     def database_cleanup(
         self,
@@ -284,42 +1310,52 @@ class CodeqlEngine(object):
             engine = CodeqlEngine("/path/to/codeql")
             engine.database_cleanup("/path/to/database", max_disk_cache=500, cleanup_upgrade_backups=True)
         """
-        if isinstance(database_path, Path):
-            database_path = str(database_path)
+        self._run(
+            self._database_cleanup_commands(
+                database_path=database_path,
+                max_disk_cache=max_disk_cache,
+                min_disk_free=min_disk_free,
+                min_disk_free_pct=min_disk_free_pct,
+                cache_cleanup=cache_cleanup,
+                cleanup_upgrade_backups=cleanup_upgrade_backups,
+            )
+        )
+
+    async def adatabase_cleanup(self, *args: Any, **kwargs: Any) -> None:
+        """
+        Async version of :meth:`database_cleanup`.
+        """
+        await self._arun(self._database_cleanup_commands(*args, **kwargs))
+
+    def _database_cleanup_commands(
+        self,
+        database_path: Union[Path, str],
+        max_disk_cache: Optional[int] = None,
+        min_disk_free: Optional[int] = None,
+        min_disk_free_pct: Optional[int] = None,
+        cache_cleanup: Optional[Literal["clear", "trim", "fit"]] = "trim",
+        cleanup_upgrade_backups: Optional[bool] = None,
+    ) -> List[str]:
+        database_path = os.fspath(database_path)
 
-        commands = [self.codeql_bin, "database", "cleanup", database_path]
+        commands = [*self._prefixes["database cleanup"], database_path]
 
         if max_disk_cache is not None:
-            commands.append(f"--max-disk-cache={max_disk_cache}")
+            commands.extend(["--max-disk-cache", str(max_disk_cache)])
 
         if min_disk_free is not None:
-            commands.append(f"--min-disk-free={min_disk_free}")
+            commands.extend(["--min-disk-free", str(min_disk_free)])
 
         if min_disk_free_pct is not None:
-            commands.append(f"--min-disk-free-pct={min_disk_free_pct}")
+            commands.extend(["--min-disk-free-pct", str(min_disk_free_pct)])
 
         if cache_cleanup is not None:
-            commands.append(f"--cache-cleanup={cache_cleanup}")
+            commands.extend(["--cache-cleanup", cache_cleanup])
 
         if cleanup_upgrade_backups:
             commands.append("--cleanup-upgrade-backups")
 
-        # Run the command
-        codeql_results = subprocess.run(
-            commands,
-            text=True,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        if codeql_results.returncode == 0:
-            log_fn = logger.info
-        else:
-            log_fn = logger.error
-        if codeql_results.stdout:
-            log_fn(codeql_results.stdout)
-        if codeql_results.stderr:
-            log_fn(codeql_results.stderr)
+        return commands
 
     def database_finalize(
         self,
@@ -350,27 +1386,50 @@ class CodeqlEngine(object):
 
         :raises subprocess.CalledProcessError: If the finalization process encounters an error.
         """
-        if isinstance(database_path, Path):
-            database_path = str(database_path)
+        self._run(
+            self._database_finalize_commands(
+                database_path=database_path,
+                db_cluster=db_cluster,
+                additional_dbs=additional_dbs,
+                no_cleanup=no_cleanup,
+                no_pre_finalize=no_pre_finalize,
+                skip_empty=skip_empty,
+            )
+        )
+
+    async def adatabase_finalize(self, *args: Any, **kwargs: Any) -> None:
+        """
+        Async version of :meth:`database_finalize`.
+        """
+        await self._arun(self._database_finalize_commands(*args, **kwargs))
+
+    def _database_finalize_commands(
+        self,
+        database_path: Union[Path, str],
+        db_cluster: bool = False,
+        additional_dbs: Optional[Union[str, List[str]]] = None,
+        no_cleanup: bool = False,
+        no_pre_finalize: bool = False,
+        skip_empty: bool = False,
+    ) -> List[str]:
+        database_path = os.fspath(database_path)
 
         # Base command setup
         commands = [
-            self.codeql_bin,
-            "database",
-            "finalize",
+            *self._prefixes["database finalize"],
             database_path,
         ]
 
         # Apply optional flags
         if db_cluster:
-            commands.append("--db-cluster")
+            commands.append(_DB_CLUSTER)
 
         if additional_dbs:
             if isinstance(additional_dbs, list):
                 additional_dbs_str = ":".join(additional_dbs)
             else:
                 additional_dbs_str = additional_dbs
-            commands.append(f"--additional-dbs={additional_dbs_str}")
+            commands.extend(["--additional-dbs", additional_dbs_str])
 
         if no_cleanup:
             commands.append("--no-cleanup")
@@ -381,22 +1440,7 @@ class CodeqlEngine(object):
         if skip_empty:
             commands.append("--skip-empty")
 
-        # Execute the finalize command
-        codeql_results = subprocess.run(
-            commands,
-            text=True,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        if codeql_results.returncode == 0:
-            log_fn = logger.info
-        else:
-            log_fn = logger.error
-        if codeql_results.stdout:
-            log_fn(codeql_results.stdout)
-        if codeql_results.stderr:
-            log_fn(codeql_results.stderr)
+        return commands
 
     def database_init(
         self,
@@ -443,16 +1487,49 @@ class CodeqlEngine(object):
 
         :raises subprocess.CalledProcessError: If the initialization process encounters an error.
         """
+        self._run(
+            self._database_init_commands(
+                database_path=database_path,
+                source_root=source_root,
+                language=language,
+                build_mode=build_mode,
+                github_auth_stdin=github_auth_stdin,
+                github_url=github_url,
+                extractor_option=extractor_option,
+                overwrite=overwrite,
+                force_overwrite=force_overwrite,
+                allow_missing_source_root=allow_missing_source_root,
+                begin_tracing=begin_tracing,
+                db_cluster=db_cluster,
+            )
+        )
+
+    async def adatabase_init(self, *args: Any, **kwargs: Any) -> None:
+        """
+        Async version of :meth:`database_init`.
+        """
+        await self._arun(self._database_init_commands(*args, **kwargs))
 
-        if isinstance(database_path, Path):
-            database_path = str(database_path)
-        if isinstance(source_root, Path):
-            source_root = str(source_root)
+    def _database_init_commands(
+        self,
+        database_path: Union[Path, str],
+        source_root: Union[Path, str],
+        language: Optional[LanguageType] = None,
+        build_mode: Optional[Literal["none", "autobuild", "manual"]] = None,
+        github_auth_stdin: bool = False,
+        github_url: Optional[str] = None,
+        extractor_option: Optional[List[str]] = None,
+        overwrite: bool = False,
+        force_overwrite: bool = False,
+        allow_missing_source_root: bool = False,
+        begin_tracing: bool = False,
+        db_cluster: bool = False,
+    ) -> List[str]:
+        database_path = os.fspath(database_path)
+        source_root = os.fspath(source_root)
 
         commands = [
-            self.codeql_bin,
-            "database",
-            "init",
+            *self._prefixes["database init"],
             "--source-root",
             source_root,
             database_path,
@@ -475,7 +1552,7 @@ class CodeqlEngine(object):
 
         if extractor_option:
             for option in extractor_option:
-                commands.append(f"--extractor-option={option}")
+                commands.extend(["--extractor-option", option])
 
         if overwrite:
             commands.append("--overwrite")
@@ -490,24 +1567,9 @@ class CodeqlEngine(object):
             commands.append("--begin-tracing")
 
         if db_cluster:
-            commands.append("--db-cluster")
-
-        # Run the command
-        codeql_results = subprocess.run(
-            commands,
-            text=True,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        if codeql_results.returncode == 0:
-            log_fn = logger.info
-        else:
-            log_fn = logger.error
-        if codeql_results.stdout:
-            log_fn(codeql_results.stdout)
-        if codeql_results.stderr:
-            log_fn(codeql_results.stderr)
+            commands.append(_DB_CLUSTER)
+
+        return commands
 
     def database_index_files(
         self,
@@ -563,60 +1625,90 @@ class CodeqlEngine(object):
 
         :raises subprocess.CalledProcessError: If the indexing process encounters an error.
         """
+        self._run(
+            self._database_index_files_commands(
+                database_path=database_path,
+                language=language,
+                threads=threads,
+                ram=ram,
+                working_dir=working_dir,
+                extractor_options=extractor_options,
+                extractor_options_file=extractor_options_file,
+                include_extensions=include_extensions,
+                include=include,
+                exclude=exclude,
+                prune=prune,
+                size_limit=size_limit,
+                total_size_limit=total_size_limit,
+                follow_symlinks=follow_symlinks,
+                find_any=find_any,
+            )
+        )
 
-        if isinstance(database_path, Path):
-            database_path = str(database_path)
+    async def adatabase_index_files(self, *args: Any, **kwargs: Any) -> None:
+        """
+        Async version of :meth:`database_index_files`.
+        """
+        await self._arun(self._database_index_files_commands(*args, **kwargs))
+
+    def _database_index_files_commands(
+        self,
+        database_path: Union[Path, str],
+        language: str,
+        threads: Optional[int] = None,
+        ram: Optional[int] = None,
+        working_dir: Optional[Union[Path, str]] = None,
+        extractor_options: Optional[List[str]] = None,
+        extractor_options_file: Optional[Union[Path, str]] = None,
+        include_extensions: Optional[List[str]] = None,
+        include: Optional[List[str]] = None,
+        exclude: Optional[List[str]] = None,
+        prune: Optional[List[str]] = None,
+        size_limit: Optional[str] = None,
+        total_size_limit: Optional[str] = None,
+        follow_symlinks: bool = True,
+        find_any: bool = False,
+    ) -> List[str]:
+        database_path = os.fspath(database_path)
         commands = [
-            self.codeql_bin,
-            "database",
-            "index-files",
+            *self._prefixes["database index-files"],
             "--language=" + language,
             database_path,
         ]
 
         if threads is not None:
-            commands.append(f"--threads={threads}")
+            commands.extend(["--threads", str(threads)])
         if ram is not None:
-            commands.append(f"--ram={ram}")
+            commands.extend(["--ram", str(ram)])
         if extractor_options:
-            commands.extend(f"--extractor-option={opt}" for opt in extractor_options)
+            for opt in extractor_options:
+                commands.extend(["--extractor-option", opt])
         if extractor_options_file:
-            commands.append(f"--extractor-options-file={extractor_options_file}")
+            commands.extend(["--extractor-options-file", str(extractor_options_file)])
         if include_extensions:
-            commands.extend(f"--include-extension={ext}" for ext in include_extensions)
+            for ext in include_extensions:
+                commands.extend(["--include-extension", ext])
         if include:
-            commands.extend(f"--include={glob}" for glob in include)
+            for glob in include:
+                commands.extend(["--include", glob])
         if exclude:
-            commands.extend(f"--exclude={glob}" for glob in exclude)
+            for glob in exclude:
+                commands.extend(["--exclude", glob])
         if prune:
-            commands.extend(f"--prune={glob}" for glob in prune)
+            for glob in prune:
+                commands.extend(["--prune", glob])
         if size_limit:
-            commands.append(f"--size-limit={size_limit}")
+            commands.extend(["--size-limit", size_limit])
         if total_size_limit:
-            commands.append(f"--total-size-limit={total_size_limit}")
+            commands.extend(["--total-size-limit", total_size_limit])
         if follow_symlinks:
-            commands.append("--follow-symlinks")
+            commands.append(_FOLLOW_SYMLINKS)
         else:
-            commands.append("--no-follow-symlinks")
+            commands.append(_NO_FOLLOW_SYMLINKS)
         if find_any:
             commands.append("--find-any")
 
-        # Run the command
-        codeql_results = subprocess.run(
-            commands,
-            text=True,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        if codeql_results.returncode == 0:
-            log_fn = logger.info
-        else:
-            log_fn = logger.error
-        if codeql_results.stdout:
-            log_fn(codeql_results.stdout)
-        if codeql_results.stderr:
-            log_fn(codeql_results.stderr)
+        return commands
 
     def database_bundle(self, database_path: Union[Path, str]) -> None:
         raise NotImplementedError()
@@ -654,13 +1746,38 @@ class CodeqlEngine(object):
 
         :raises subprocess.CalledProcessError: If the upgrade process encounters an error.
         """
-        if isinstance(database_path, Path):
-            database_path = str(database_path)
+        self._run(
+            self._database_upgrade_commands(
+                database_path=database_path,
+                search_path=search_path,
+                additional_packs=additional_packs,
+                target_dbscheme=target_dbscheme,
+                allow_downgrades=allow_downgrades,
+                threads=threads,
+                ram=ram,
+            )
+        )
+
+    async def adatabase_upgrade(self, *args: Any, **kwargs: Any) -> None:
+        """
+        Async version of :meth:`database_upgrade`.
+        """
+        await self._arun(self._database_upgrade_commands(*args, **kwargs))
+
+    def _database_upgrade_commands(
+        self,
+        database_path: Union[Path, str],
+        search_path: Optional[Union[Path, str, List[Union[Path, str]]]] = None,
+        additional_packs: Optional[Union[Path, str, List[Union[Path, str]]]] = None,
+        target_dbscheme: Optional[Union[Path, str]] = None,
+        allow_downgrades: bool = False,
+        threads: Optional[int] = None,
+        ram: Optional[int] = None,
+    ) -> List[str]:
+        database_path = os.fspath(database_path)
 
         commands = [
-            self.codeql_bin,
-            "database",
-            "upgrade",
+            *self._prefixes["database upgrade"],
             database_path,
         ]
 
@@ -688,22 +1805,7 @@ class CodeqlEngine(object):
         if ram is not None:
             commands.extend(["--ram", str(ram)])
 
-        # Run the command
-        codeql_results = subprocess.run(
-            commands,
-            text=True,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        if codeql_results.returncode == 0:
-            log_fn = logger.info
-        else:
-            log_fn = logger.error
-        if codeql_results.stdout:
-            log_fn(codeql_results.stdout)
-        if codeql_results.stderr:
-            log_fn(codeql_results.stderr)
+        return commands
 
     def database_export_diagnostics(self, database_path: Union[Path, str]) -> None:
         raise NotImplementedError()
@@ -756,12 +1858,45 @@ class CodeqlEngine(object):
         :returns: None
         :rtype: None
         """
-        if isinstance(database_path, Path):
-            database_path = str(database_path)
+        self._run(
+            self._database_run_queries_commands(
+                database_path=database_path,
+                queries=queries,
+                threads=threads,
+                ram=ram,
+                model_packs=model_packs,
+                threat_models=threat_models,
+                timeout=timeout,
+                no_rerun=no_rerun,
+                save_cache=save_cache,
+                evaluator_log=evaluator_log,
+                warnings=warnings,
+            )
+        )
+
+    async def adatabase_run_queries(self, *args: Any, **kwargs: Any) -> None:
+        """
+        Async version of :meth:`database_run_queries`.
+        """
+        await self._arun(self._database_run_queries_commands(*args, **kwargs))
+
+    def _database_run_queries_commands(
+        self,
+        database_path: Union[Path, str],
+        queries: Union[List[str], str],
+        threads: Optional[int] = 1,
+        ram: Optional[int] = 2048,
+        model_packs: Optional[List[str]] = None,
+        threat_models: Optional[List[str]] = None,
+        timeout: Optional[int] = 0,
+        no_rerun: bool = False,
+        save_cache: bool = False,
+        evaluator_log: Optional[str] = None,
+        warnings: str = "show",
+    ) -> List[str]:
+        database_path = os.fspath(database_path)
         commands = [
-            self.codeql_bin,
-            "database",
-            "run-queries",
+            *self._prefixes["database run-queries"],
             "--threads",
             str(threads),
             "--ram",
@@ -777,16 +1912,16 @@ class CodeqlEngine(object):
         # Add optional model packs
         if model_packs:
             for pack in model_packs:
-                commands.append(f"--model-packs={pack}")
+                commands.extend(["--model-packs", pack])
 
         # Add optional threat models
         if threat_models:
             for model in threat_models:
-                commands.append(f"--threat-model={model}")
+                commands.extend(["--threat-model", model])
 
         # Add other options
         if no_rerun:
-            commands.append("--no-rerun")
+            commands.append(_NO_RERUN)
         if save_cache:
             commands.append("--save-cache")
         if evaluator_log:
@@ -800,22 +1935,7 @@ class CodeqlEngine(object):
         if timeout > 0:
             commands.extend(["--timeout", str(timeout)])
 
-        # Run the command
-        codeql_results = subprocess.run(
-            commands,
-            text=True,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        if codeql_results.returncode == 0:
-            log_fn = logger.info
-        else:
-            log_fn = logger.error
-        if codeql_results.stdout:
-            log_fn(codeql_results.stdout)
-        if codeql_results.stderr:
-            log_fn(codeql_results.stderr)
+        return commands
 
     def bqrs_decode(
         self,
@@ -857,66 +1977,69 @@ class CodeqlEngine(object):
         :returns: None
         :rtype: None
         """
+        self._run_cached(
+            self._bqrs_decode_commands,
+            "output_file",
+            bqrs_file=bqrs_file,
+            output_file=output_file,
+            result_set=result_set,
+            sort_key=sort_key,
+            sort_direction=sort_direction,
+            format=format,
+            no_titles=no_titles,
+            entities=entities,
+            rows=rows,
+            start_at=start_at,
+        )
 
-        if isinstance(bqrs_file, Path):
-            bqrs_file = str(bqrs_file)
-
-        if output_file:
-            if isinstance(output_file, Path):
-                output_file = str(output_file)
-
-        # Base command for decoding the BQRS file
-        commands = [self.codeql_bin, "bqrs", "decode", bqrs_file]
-
-        # Output file option
-        if output_file:
-            commands.extend(["--output", output_file])
-
-        # Result set option
-        if result_set:
-            commands.extend(["--result-set", result_set])
-
-        # Sorting options
-        if sort_key:
-            commands.extend(["--sort-key", ",".join(sort_key)])
-
-        if sort_direction:
-            commands.extend(["--sort-direction", ",".join(sort_direction)])
-
-        # Format option
-        commands.extend(["--format", format])
+    async def abqrs_decode(self, *args: Any, **kwargs: Any) -> None:
+        """
+        Async version of :meth:`bqrs_decode`.
+        """
+        await self._arun_cached(
+            self._bqrs_decode_commands, "output_file", *args, **kwargs
+        )
 
-        # No titles option for text and csv formats
-        if no_titles:
-            commands.append("--no-titles")
+    def bqrs_decode_many(
+        self,
+        files: List[Tuple[Union[Path, str], Optional[Union[Path, str]]]],
+        max_workers: Optional[int] = None,
+        **options: Any,
+    ) -> None:
+        """
+        Decodes several BQRS files concurrently, see :meth:`bqrs_decode`.
 
-        # Entities option for advanced output formatting
-        if entities:
-            commands.extend(["--entities", ",".join(entities)])
+        :param files: Pairs of the BQRS file to decode and the file to write the decoded output to.
+        :type files: List[Tuple[Union[Path, str], Optional[Union[Path, str]]]]
+        :param max_workers: Maximum number of concurrent CodeQL processes, default to the CPU count.
+        :type max_workers: Optional[int]
+        :param options: Other options of :meth:`bqrs_decode`, shared by all files.
 
-        # Pagination options
-        if rows is not None:
-            commands.extend(["--rows", str(rows)])
+        :raises subprocess.CalledProcessError: If decoding any of the files fails, after all files are processed.
+        """
+        self._fan_out(
+            lambda file: self.bqrs_decode(file[0], file[1], **options),
+            files,
+            max_workers,
+        )
 
-        if start_at is not None:
-            commands.extend(["--start-at", str(start_at)])
+    def _bqrs_decode_commands(
+        self,
+        bqrs_file: Union[Path, str],
+        output_file: Optional[Union[Path, str]] = None,
+        result_set: Optional[str] = None,
+        sort_key: Optional[List[str]] = None,
+        sort_direction: Optional[List[Literal["asc", "desc"]]] = None,
+        format: Literal["text", "csv", "json", "bqrs"] = "text",
+        no_titles: bool = False,
+        entities: Optional[List[str]] = None,
+        rows: Optional[int] = None,
+        start_at: Optional[int] = None,
+    ) -> List[str]:
+        bqrs_file = os.fspath(bqrs_file)
 
-        # Run the command
-        codeql_results = subprocess.run(
-            commands,
-            text=True,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        if codeql_results.returncode == 0:
-            log_fn = logger.info
-        else:
-            log_fn = logger.error
-        if codeql_results.stdout:
-            log_fn(codeql_results.stdout)
-        if codeql_results.stderr:
-            log_fn(codeql_results.stderr)
+        commands = [*self._prefixes["bqrs decode"], bqrs_file]
+        return _encode_options(commands, _BQRS_DECODE_OPTIONS, locals())
 
     def bqrs_diff(
         self,
@@ -948,50 +2071,77 @@ class CodeqlEngine(object):
 
         :raises subprocess.CalledProcessError: If the comparison process encounters an error.
         """
-        if isinstance(file1, Path):
-            file1 = str(file1)
-        if isinstance(file2, Path):
-            file2 = str(file2)
-        if left and isinstance(left, Path):
-            left = str(left)
-        if right and isinstance(right, Path):
-            right = str(right)
-        if both and isinstance(both, Path):
-            both = str(both)
-
-        commands = [self.codeql_bin, "bqrs", "diff", file1, file2]
-
-        if left:
-            commands.extend(["--left", left])
-
-        if right:
-            commands.extend(["--right", right])
-
-        if both:
-            commands.extend(["--both", both])
-
-        if retain_result_sets:
-            commands.extend(["--retain-result-sets", retain_result_sets])
-
-        if compare_internal_ids:
-            commands.append("--compare-internal-ids")
-
-        # Run the command
-        codeql_results = subprocess.run(
-            commands,
-            text=True,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+        if self._bqrs_diff_trivial(left, right, compare_internal_ids) and (
+            self.bqrs_hash(file1) == self.bqrs_hash(file2)
+        ):
+            self._bqrs_diff_equal(file1, both)
+            return
+        self._run_short(
+            self._bqrs_diff_commands(
+                file1=file1,
+                file2=file2,
+                left=left,
+                right=right,
+                both=both,
+                retain_result_sets=retain_result_sets,
+                compare_internal_ids=compare_internal_ids,
+            ),
+            outputs=(left, right, both),
         )
-        if codeql_results.returncode == 0:
-            log_fn = logger.info
-        else:
-            log_fn = logger.error
-        if codeql_results.stdout:
-            log_fn(codeql_results.stdout)
-        if codeql_results.stderr:
-            log_fn(codeql_results.stderr)
+
+    async def abqrs_diff(self, *args: Any, **kwargs: Any) -> None:
+        """
+        Async version of :meth:`bqrs_diff`.
+        """
+        bound = inspect.signature(self._bqrs_diff_commands).bind(*args, **kwargs)
+        bound.apply_defaults()
+        options = bound.arguments
+        if self._bqrs_diff_trivial(
+            options["left"], options["right"], options["compare_internal_ids"]
+        ) and (
+            await self.abqrs_hash(options["file1"])
+            == await self.abqrs_hash(options["file2"])
+        ):
+            self._bqrs_diff_equal(options["file1"], options["both"])
+            return
+        await self._arun(self._bqrs_diff_commands(**options))
+
+    @staticmethod
+    def _bqrs_diff_trivial(
+        left: Optional[Union[Path, str]],
+        right: Optional[Union[Path, str]],
+        compare_internal_ids: bool,
+    ) -> bool:
+        """
+        Whether a diff of two files with equal stable hashes can be answered
+        without CodeQL. An empty --left/--right BQRS cannot be written by hand,
+        and the stable hash does not cover internal entity IDs.
+        """
+        return left is None and right is None and not compare_internal_ids
+
+    @staticmethod
+    def _bqrs_diff_equal(
+        file1: Union[Path, str], both: Optional[Union[Path, str]]
+    ) -> None:
+        logger.info(f"Skipping bqrs diff of {os.fspath(file1)}: the hashes are equal")
+        if both is not None:
+            shutil.copyfile(file1, both)
+
+    def _bqrs_diff_commands(
+        self,
+        file1: Union[Path, str],
+        file2: Union[Path, str],
+        left: Optional[Union[Path, str]] = None,
+        right: Optional[Union[Path, str]] = None,
+        both: Optional[Union[Path, str]] = None,
+        retain_result_sets: Optional[str] = "nodes,edges,subpaths",
+        compare_internal_ids: bool = False,
+    ) -> List[str]:
+        file1 = os.fspath(file1)
+        file2 = os.fspath(file2)
+
+        commands = [*self._prefixes["bqrs diff"], file1, file2]
+        return _encode_options(commands, _BQRS_DIFF_OPTIONS, locals())
 
     def bqrs_hash(self, file: Union[Path, str]) -> str:
         """
@@ -1005,37 +2155,48 @@ class CodeqlEngine(object):
 
         :raises subprocess.CalledProcessError: If the hashing process encounters an error.
         """
-        if isinstance(file, Path):
-            file = str(file)
+        key = _bqrs_hash_key(file)
+        if (digest := _lru_get(self._hash_cache, key)) is None:
+            digest = self._run_short(self._bqrs_hash_commands(file), capture=True)
+            digest = _lru_put(self._hash_cache, key, digest.strip(), _HASH_CACHE_SIZE)
+        return digest
+
+    async def abqrs_hash(self, file: Union[Path, str]) -> str:
+        """
+        Async version of :meth:`bqrs_hash`.
+        """
+        key = _bqrs_hash_key(file)
+        if (digest := _lru_get(self._hash_cache, key)) is None:
+            digest = await self._arun_captured(self._bqrs_hash_commands(file))
+            digest = _lru_put(self._hash_cache, key, digest.strip(), _HASH_CACHE_SIZE)
+        return digest
+
+    def _bqrs_hash_commands(self, file: Union[Path, str]) -> List[str]:
+        file = os.fspath(file)
 
         # Prepare the command for hashing the BQRS file
         commands = [
-            self.codeql_bin,
-            "bqrs",
-            "hash",
+            *self._prefixes["bqrs hash"],
             file,
         ]
 
-        # Execute the command
-        result = subprocess.run(commands, text=True, capture_output=True, check=True)
-
-        # Extract the hash from the command output
-        return result.stdout.strip()
+        return commands
 
     def bqrs_info(
         self,
         bqrs_file: Union[Path, str],
-        format: Literal["text", "json"] = "text",
+        format: Literal["text", "json"] = "json",
         paginate_rows: Optional[int] = None,
         paginate_result_set: Optional[str] = None,
-    ) -> None:
+    ) -> Union[Dict[str, Any], str]:
         """
-        Displays metadata information for a BQRS file.
+        Displays and returns metadata information for a BQRS file. The result is
+        memoized until the file changes.
 
         :param bqrs_file: The path to the BQRS file.
         :type bqrs_file: Union[Path, str]
 
-        :param format: The output format. Default is "text".
+        :param format: The output format. Default is "json".
         :type format: Literal["text", "json"]
 
         :param paginate_rows: When used with --format=json, this calculates a byte offset table for paginated results.
@@ -1044,50 +2205,69 @@ class CodeqlEngine(object):
         :param paginate_result_set: Only process the result set with this name for pagination.
         :type paginate_result_set: Optional[str]
 
+        :returns: The parsed JSON metadata, or the text output if format is "text".
+        :rtype: Union[Dict[str, Any], str]
+
         :raises subprocess.CalledProcessError: If the command fails.
         """
-        if isinstance(bqrs_file, Path):
-            bqrs_file = str(bqrs_file)
-
-        # Prepare the base command
-        commands = [
-            self.codeql_bin,
-            "bqrs",
-            "info",
-            bqrs_file,
-        ]
-
-        # Add optional flags
-        if format:
-            commands.append(f"--format={format}")
-
-        if paginate_rows is not None:
-            commands.append(f"--paginate-rows={paginate_rows}")
-
-        if paginate_result_set:
-            commands.append(f"--paginate-result-set={paginate_result_set}")
-
-        # Run the command
-        codeql_results = subprocess.run(
-            commands,
-            text=True,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+        commands = self._bqrs_info_commands(
+            bqrs_file=bqrs_file,
+            format=format,
+            paginate_rows=paginate_rows,
+            paginate_result_set=paginate_result_set,
         )
-        if codeql_results.returncode == 0:
-            log_fn = logger.info
-        else:
-            log_fn = logger.error
-        if codeql_results.stdout:
-            log_fn(codeql_results.stdout)
-        if codeql_results.stderr:
-            log_fn(codeql_results.stderr)
+        key = (_bqrs_hash_key(bqrs_file), format, paginate_rows, paginate_result_set)
+        if (output := _lru_get(self._info_cache, key)) is None:
+            output = _lru_put(
+                self._info_cache,
+                key,
+                self._run_short(commands, capture=True),
+                _INFO_CACHE_SIZE,
+            )
+        info = json.loads(output) if format == "json" else output
+        logger.debug("%s", info)
+        return info
+
+    async def abqrs_info(self, *args: Any, **kwargs: Any) -> Union[Dict[str, Any], str]:
+        """
+        Async version of :meth:`bqrs_info`.
+        """
+        bound = inspect.signature(self._bqrs_info_commands).bind(*args, **kwargs)
+        bound.apply_defaults()
+        options = bound.arguments
+        key = (
+            _bqrs_hash_key(options["bqrs_file"]),
+            options["format"],
+            options["paginate_rows"],
+            options["paginate_result_set"],
+        )
+        if (output := _lru_get(self._info_cache, key)) is None:
+            output = _lru_put(
+                self._info_cache,
+                key,
+                await self._arun_captured(self._bqrs_info_commands(**options)),
+                _INFO_CACHE_SIZE,
+            )
+        info = json.loads(output) if options["format"] == "json" else output
+        logger.debug("%s", info)
+        return info
+
+    def _bqrs_info_commands(
+        self,
+        bqrs_file: Union[Path, str],
+        format: Literal["text", "json"] = "json",
+        paginate_rows: Optional[int] = None,
+        paginate_result_set: Optional[str] = None,
+    ) -> List[str]:
+        bqrs_file = os.fspath(bqrs_file)
+
+        commands = [*self._prefixes["bqrs info"], bqrs_file]
+        return _encode_options(commands, _BQRS_INFO_OPTIONS, locals())
 
     def bqrs_interpret(
         self,
         bqrs_file: Union[Path, str],
-        output: Union[Path, str],
+        output: Optional[Union[Path, str]] = None,
         format: Literal[
             "csv", "sarif-latest", "sarifv2.1.0", "graphtext", "dgml", "dot"
         ] = "csv",
@@ -1111,12 +2291,12 @@ class CodeqlEngine(object):
         dot_location_url_format: Optional[str] = None,
         sublanguage_file_coverage: Optional[bool] = None,
         sarif_category: Optional[str] = None,
-        threads: Optional[int] = 1,
+        threads: Optional[int] = None,
         column_kind: Optional[Literal["utf8", "utf16", "utf32", "byte"]] = None,
         unicode_new_lines: Optional[bool] = None,
         source_archive: Optional[Union[Path, str]] = None,
         source_location_prefix: Optional[Union[Path, str]] = None,
-    ) -> None:
+    ) -> Optional[bytes]:
         """
         Interprets a single BQRS file and generates output in the specified format.
 
@@ -1126,8 +2306,8 @@ class CodeqlEngine(object):
         :param format: The format of the output.
         :type format: Literal["csv", "sarif-latest", "sarifv2.1.0", "graphtext", "dgml"]
 
-        :param output: The output path for the results.
-        :type output: Union[Path, str]
+        :param output: The output path for the results. If None, the results are returned instead.
+        :type output: Optional[Union[Path, str]]
 
         :param query_metadata: A list of query metadata key-value pairs.
         :type query_metadata: List[Tuple[str, str]]
@@ -1177,7 +2357,7 @@ class CodeqlEngine(object):
         :param sarif_category: The category for the SARIF output.
         :type sarif_category: Optional[str]
 
-        :param threads: The number of threads to use for path calculation.
+        :param threads: The number of threads to use for path calculation. Defaults to the number of CPUs.
         :type threads: Optional[int]
 
         :param column_kind: The column kind for SARIF output.
@@ -1192,111 +2372,116 @@ class CodeqlEngine(object):
         :param source_location_prefix: The source location prefix.
         :type source_location_prefix: Optional[Union[Path, str]]
 
+        :returns: The interpreted results if no output path is given, otherwise None.
+        :rtype: Optional[bytes]
+
         :raises subprocess.CalledProcessError: If the interpretation process encounters an error.
         """
+        return self._run_or_read(
+            self._bqrs_interpret_commands,
+            "output",
+            bqrs_file=bqrs_file,
+            output=output,
+            format=format,
+            query_metadata=query_metadata,
+            max_paths=max_paths,
+            sarif_add_file_contents=sarif_add_file_contents,
+            sarif_add_snippets=sarif_add_snippets,
+            sarif_add_query_help=sarif_add_query_help,
+            sarif_include_query_help=sarif_include_query_help,
+            no_sarif_include_alert_provenance=no_sarif_include_alert_provenance,
+            sarif_group_rules_by_pack=sarif_group_rules_by_pack,
+            sarif_multicause_markdown=sarif_multicause_markdown,
+            no_sarif_minify=no_sarif_minify,
+            sarif_run_property=sarif_run_property,
+            no_group_results=no_group_results,
+            csv_location_format=csv_location_format,
+            dot_location_url_format=dot_location_url_format,
+            sublanguage_file_coverage=sublanguage_file_coverage,
+            sarif_category=sarif_category,
+            threads=threads,
+            column_kind=column_kind,
+            unicode_new_lines=unicode_new_lines,
+            source_archive=source_archive,
+            source_location_prefix=source_location_prefix,
+        )
+
+    async def abqrs_interpret(self, *args: Any, **kwargs: Any) -> Optional[bytes]:
+        """
+        Async version of :meth:`bqrs_interpret`.
+        """
+        return await self._arun_or_read(
+            self._bqrs_interpret_commands, "output", *args, **kwargs
+        )
+
+    def bqrs_interpret_many(
+        self,
+        files: List[Tuple[Union[Path, str], Union[Path, str]]],
+        max_workers: Optional[int] = None,
+        **options: Any,
+    ) -> None:
+        """
+        Interprets several BQRS files concurrently, see :meth:`bqrs_interpret`.
 
-        if isinstance(bqrs_file, Path):
-            bqrs_file = str(bqrs_file)
-        if isinstance(output, Path):
-            output = str(output)
-        if source_archive and isinstance(source_archive, Path):
-            source_archive = str(source_archive)
-        if source_location_prefix and isinstance(source_location_prefix, Path):
-            source_location_prefix = str(source_location_prefix)
+        :param files: Pairs of the BQRS file to interpret and the output path for its results.
+        :type files: List[Tuple[Union[Path, str], Union[Path, str]]]
+        :param max_workers: Maximum number of concurrent CodeQL processes, default to the CPU count.
+        :type max_workers: Optional[int]
+        :param options: Other options of :meth:`bqrs_interpret`, shared by all files.
+
+        :raises subprocess.CalledProcessError: If interpreting any of the files fails, after all files are processed.
+        """
+        self._fan_out(
+            lambda file: self.bqrs_interpret(file[0], file[1], **options),
+            files,
+            max_workers,
+        )
+
+    def _bqrs_interpret_commands(
+        self,
+        bqrs_file: Union[Path, str],
+        output: Optional[Union[Path, str]] = None,
+        format: Literal[
+            "csv", "sarif-latest", "sarifv2.1.0", "graphtext", "dgml", "dot"
+        ] = "csv",
+        query_metadata: List[Tuple[str, str]] = [],
+        max_paths: Optional[int] = 4,
+        sarif_add_file_contents: Optional[bool] = None,
+        sarif_add_snippets: Optional[bool] = None,
+        sarif_add_query_help: Optional[bool] = None,
+        sarif_include_query_help: Optional[
+            Literal["always", "custom_queries_only", "never"]
+        ] = None,
+        no_sarif_include_alert_provenance: Optional[bool] = None,
+        sarif_group_rules_by_pack: Optional[bool] = None,
+        sarif_multicause_markdown: Optional[bool] = None,
+        no_sarif_minify: Optional[bool] = None,
+        sarif_run_property: Optional[List[Tuple[str, str]]] = None,
+        no_group_results: Optional[bool] = None,
+        csv_location_format: Literal[
+            "uri", "line-column", "offset-length"
+        ] = "line-column",
+        dot_location_url_format: Optional[str] = None,
+        sublanguage_file_coverage: Optional[bool] = None,
+        sarif_category: Optional[str] = None,
+        threads: Optional[int] = None,
+        column_kind: Optional[Literal["utf8", "utf16", "utf32", "byte"]] = None,
+        unicode_new_lines: Optional[bool] = None,
+        source_archive: Optional[Union[Path, str]] = None,
+        source_location_prefix: Optional[Union[Path, str]] = None,
+    ) -> List[str]:
+        bqrs_file = os.fspath(bqrs_file)
+        output = os.fspath(output)
+        if threads is None:
+            threads = os.cpu_count() or 1
 
         commands = [
-            self.codeql_bin,
-            "bqrs",
-            "interpret",
+            *self._prefixes["bqrs interpret"],
             "--format=" + format,
             "--output=" + output,
             bqrs_file,
         ]
-
-        for key, value in query_metadata:
-            commands.extend(["-t", f"{key}={value}"])
-
-        if max_paths:
-            commands.extend(["--max-paths", str(max_paths)])
-
-        if sarif_add_file_contents is not None:
-            if sarif_add_file_contents:
-                commands.append("--sarif-add-file-contents")
-            else:
-                commands.append("--no-sarif-add-file-contents")
-        if sarif_add_snippets is not None:
-            if sarif_add_snippets:
-                commands.append("--sarif-add-snippets")
-            else:
-                commands.append("--no-sarif-add-snippets")
-        if sarif_add_query_help is not None:
-            if sarif_add_query_help:
-                commands.append("--sarif-add-query-help")
-            else:
-                commands.append("--no-sarif-add-query-help")
-
-        if sarif_include_query_help is not None:
-            commands.extend(["--sarif-include-query-help", sarif_include_query_help])
-
-        if no_sarif_include_alert_provenance:
-            commands.append("--no-sarif-include-alert-provenance")
-        if sarif_group_rules_by_pack is not None:
-            if sarif_group_rules_by_pack:
-                commands.append("--sarif-group-rules-by-pack")
-            else:
-                commands.append("--no-sarif-group-rules-by-pack")
-        if sarif_multicause_markdown is not None:
-            if sarif_multicause_markdown:
-                commands.append("--sarif-multicause-markdown")
-            else:
-                commands.append("--no-sarif-multicause-markdown")
-        if no_sarif_minify:
-            commands.append("--no-sarif-minify")
-
-        if sarif_run_property:
-            for key, value in sarif_run_property:
-                commands.extend(["--sarif-run-property", f"{key}={value}"])
-
-        if no_group_results:
-            commands.append("--no-group-results")
-        commands.extend(["--csv-location-format", csv_location_format])
-
-        if dot_location_url_format:
-            commands.extend(["--dot-location-url-format", dot_location_url_format])
-
-        if sublanguage_file_coverage:
-            commands.append("--sublanguage-file-coverage")
-
-        if sarif_category:
-            commands.extend(["--sarif-category", sarif_category])
-
-        if threads:
-            commands.extend(["-j", str(threads)])
-
-        if column_kind:
-            commands.extend(["--column-kind", column_kind])
-
+        _encode_options(commands, _BQRS_INTERPRET_OPTIONS, locals())
         if not unicode_new_lines:
             commands.append("--no-unicode-new-lines")
-
-        if source_archive:
-            commands.extend(["--source-archive", source_archive])
-        if source_location_prefix:
-            commands.extend(["--source-location-prefix", source_location_prefix])
-
-        # Run the command
-        codeql_results = subprocess.run(
-            commands,
-            text=True,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        if codeql_results.returncode == 0:
-            log_fn = logger.info
-        else:
-            log_fn = logger.error
-        if codeql_results.stdout:
-            log_fn(codeql_results.stdout)
-        if codeql_results.stderr:
-            log_fn(codeql_results.stderr)
+        return commands
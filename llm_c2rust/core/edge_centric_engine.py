@@ -4,14 +4,15 @@ import random
 import sys
 import time
 from asyncio.log import logger
-from collections import defaultdict
-from collections.abc import AsyncGenerator, Container, Iterable
+from collections import Counter, defaultdict
+from collections.abc import AsyncGenerator, Container, Iterable, MutableMapping, Set
+from functools import lru_cache
 from typing import TYPE_CHECKING, Any
+from weakref import WeakKeyDictionary
 
 from tqdm import tqdm
 
 from llm_c2rust.llm.LLM import EdgeCentricAgent
-from llm_c2rust.analyzer.matcher import TreesitterMatcher
 from llm_c2rust.analyzer.rust_pieces import RustCode
 from llm_c2rust.analyzer.utils import RustPieceRef
 
@@ -28,9 +29,9 @@ from llm_c2rust.core.utils import (
     ConflictReport,
 )
 from llm_c2rust.llm.api_inference import AsyncAPIInference
-from llm_c2rust.parser.rust_parser import grammar_correct
 from llm_c2rust.segmenter.code_segment import CodeSegment
 from llm_c2rust.segmenter.segmenter import Segmenter
+from llm_c2rust.utils.hash import calculate_md5
 
 if TYPE_CHECKING:
     from llm_c2rust.core.transpiler import ProjectTranspiler
@@ -39,11 +40,21 @@ if TYPE_CHECKING:
 logger = logging.getLogger(__name__)
 
 GRAMMAR_RETRY = 2
+# random draws tried by _pick_randomly before it falls back to a scan
+PICK_ATTEMPTS = 32
+
+
+# only the texts of the current and the previous round are compared again,
+# and every entry keeps a whole parsed workspace alive
+@lru_cache(maxsize=4)
+def _parsed_rust(text: str) -> RustCode:
+    # shared between calls, so only for read-only use
+    return RustCode.from_text(text)
 
 
 def interface_equal(original: str, new: str) -> bool:
-    original_p = RustCode.from_text(original)
-    new_p = RustCode.from_text(new)
+    original_p = _parsed_rust(original)
+    new_p = _parsed_rust(new)
 
     return original_p.interface_equal(new_p)
 
@@ -59,16 +70,23 @@ class EdgeCentricEngine(InteractEngine):
         temperature: float,
         max_retry: int,
         max_resolve_round: int,
+        max_concurrency: int = 16,
+        response_cache: MutableMapping[str, str] | None = None,
     ):
         super().__init__(
-            segmenter, predicator, token_num, token_num_method, temperature
+            segmenter,
+            predicator,
+            token_num,
+            token_num_method,
+            temperature,
+            max_concurrency,
         )
 
         self.max_retry = max_retry
         self.todo_prority = 3 * (max_retry + 1)
         self.max_resolve_round = max_resolve_round
         self._workspace = EdgeCentricWorkspace()
-        self._agent = EdgeCentricAgent(predicator)
+        self._agent = EdgeCentricAgent(predicator, response_cache)
         self._in_synthesis = set()
         if predicator.model_name.startswith("qwen"):
             # Qwen like to split the answer into multiple parts
@@ -100,10 +118,11 @@ class EdgeCentricEngine(InteractEngine):
                 previous_result=prev_result,
                 signatures=signatures,
                 temperature=self.temperature,
+                attempt=i,
             )
 
-            trans_result = self._collect_rust_code(raw_result) or ""
-            if not grammar_correct(trans_result):
+            trans_result = await self._rust_code_of(raw_result)
+            if not await self._grammar_correct(trans_result):
 
                 continue
             return trans_result
@@ -112,11 +131,37 @@ class EdgeCentricEngine(InteractEngine):
         return trans_result
 
     _total_relation_num: int
-    _relations: set[tuple[CodeSegment, CodeSegment]]
+    # relation -> its index in _relation_list, which allows O(1) random picks
+    _relations: dict[tuple[CodeSegment, CodeSegment], int]
+    _relation_list: list[tuple[CodeSegment, CodeSegment]]
+    # adjacency of _relations: segment -> segments it uses / is used by
+    _out_adj: defaultdict[CodeSegment, set[CodeSegment]]
+    _in_adj: defaultdict[CodeSegment, set[CodeSegment]]
     _relation_try_count: dict[tuple[CodeSegment, CodeSegment], int]
-    _segment_timestamp: dict[CodeSegment, float]
+    _segment_timestamp: WeakKeyDictionary[CodeSegment, float]
+    _synthesis_released: asyncio.Event
     _bar: tqdm
 
+    def _insert_relation(self, relation: tuple[CodeSegment, CodeSegment]):
+        if relation in self._relations:
+            return
+        self._relations[relation] = len(self._relation_list)
+        self._relation_list.append(relation)
+        s1, s2 = relation
+        self._out_adj[s1].add(s2)
+        self._in_adj[s2].add(s1)
+
+    def _discard_relation(self, relation: tuple[CodeSegment, CodeSegment]):
+        # swap with the last relation so that the list stays dense
+        index = self._relations.pop(relation)
+        last = self._relation_list.pop()
+        if last != relation:
+            self._relation_list[index] = last
+            self._relations[last] = index
+        s1, s2 = relation
+        self._out_adj[s1].discard(s2)
+        self._in_adj[s2].discard(s1)
+
     def _add_relation(self, r: Iterable[tuple[CodeSegment, CodeSegment]]):
 
         for s1, s2 in set(r):
@@ -127,78 +172,98 @@ class EdgeCentricEngine(InteractEngine):
                     f"Translating relation {s1.id} -> {s2.id} exceeds 3 times, skip."
                 )
                 continue
-            self._relations.add((s1, s2))
-        self._bar.n = self._total_relation_num - len(self._relations)
-        self._bar.refresh()
+            self._insert_relation((s1, s2))
+        self._update_bar()
 
     def _remove_relation(self, r: Iterable[tuple[CodeSegment, CodeSegment]]):
         for s1, s2 in set(r):
             if (s1, s2) not in self._relations:
                 continue
-            self._relations.remove((s1, s2))
+            self._discard_relation((s1, s2))
             self._relation_try_count[(s1, s2)] += 1
-        self._bar.n = self._total_relation_num - len(self._relations)
-        self._bar.refresh()
+        self._update_bar()
+
+    def _update_bar(self):
+        # update() only redraws once mininterval has passed, unlike refresh()
+        self._bar.update(self._total_relation_num - len(self._relations) - self._bar.n)
 
     def _get_surrounding(self, s: CodeSegment):
         yield from filter(lambda u: u not in self._in_synthesis, s.use)
         yield from filter(lambda u: u not in self._in_synthesis, s.used)
 
-    def _calc_token_num(self, segments: Iterable[CodeSegment]):
-        prev_result, signatures = self.workspace.context_of(segments)
-        return self.tokenizer.token_num("\n".join(s.text for s in segments))
+    def _calc_token_num(self, segments: Iterable[CodeSegment]) -> int:
+        # one extra token for the newline joining each segment
+        return sum(self._segment_token_num(s) + 1 for s in segments)
 
     def _pick_randomly(
         self, exclude: Container[CodeSegment]
     ) -> tuple[CodeSegment, CodeSegment] | None:
 
-        for s1, s2 in sorted(self._relations, key=lambda _: random.random()):
-            if s1 in exclude or s2 in exclude:
-                continue
-            return s1, s2
-
-    def _vote_of_candidates(
-        self, chosen: Container[CodeSegment], candidates: Iterable[CodeSegment]
-    ) -> dict[CodeSegment, int]:
-        votes = {}
-        for c in candidates:
-            votes[c] = sum(
-                u in chosen for u in c.use if (c, u) in self._relations
-            ) + sum(u in chosen for u in c.used if (u, c) in self._relations)
-        return dict(filter(lambda x: x[1], votes.items()))
+        relations = self._relation_list
+        if not relations:
+            return None
+        for _ in range(PICK_ATTEMPTS):
+            s1, s2 = relations[random.randrange(len(relations))]
+            if s1 not in exclude and s2 not in exclude:
+                return s1, s2
+        # most relations are excluded, scan once from a random offset
+        start = random.randrange(len(relations))
+        for s1, s2 in relations[start:] + relations[:start]:
+            if s1 not in exclude and s2 not in exclude:
+                return s1, s2
+        return None
+
+    def _vote_for_neighbors(self, s: CodeSegment, votes: Counter[CodeSegment]):
+        """
+        Adds the votes of a newly chosen segment to the segments it shares a relation with.
+        """
+        votes.update(self._out_adj.get(s, ()))
+        votes.update(self._in_adj.get(s, ()))
 
     async def _choose_to_trans(self) -> set[CodeSegment]:
 
         chosen = set()
         while not (picked := self._pick_randomly(exclude=self._in_synthesis)):
-            await asyncio.sleep(0.01)
+            self._synthesis_released.clear()
+            await self._synthesis_released.wait()
 
         chosen.update(picked)
-        candidates = set(self._get_surrounding(picked[0])) | set(
-            self._get_surrounding(picked[1])
-        )
-        if self._calc_token_num(picked) > self.max_source_tokens:
+        candidates = (
+            set(self._get_surrounding(picked[0]))
+            | set(self._get_surrounding(picked[1]))
+        ) - chosen
+        # number of relations between each segment and the chosen ones
+        votes: Counter[CodeSegment] = Counter()
+        for s in chosen:
+            self._vote_for_neighbors(s, votes)
+        chosen_tokens = self._calc_token_num(chosen)
+        if chosen_tokens > self.max_source_tokens:
             logger.warning(
                 f"Token num of {picked[0].id} and {picked[1].id} exceeds {self.max_source_tokens}"
             )
         out_sizes: set[CodeSegment] = set()  # candidates that will exceed size if added
         while candidates:
 
-            votes = defaultdict(int)
-
-            votes = self._vote_of_candidates(chosen, candidates)
-            if votes:
-                new_chosen = max(votes, key=lambda s: votes[s])
-            else:
+            new_chosen = max(candidates, key=votes.__getitem__)
+            if not votes[new_chosen]:
                 # select the candidate with highest timestamp
-                new_chosen = max(candidates, key=lambda s: self._segment_timestamp[s])
+                new_chosen = max(
+                    candidates, key=lambda s: self._segment_timestamp.get(s, 0.0)
+                )
             candidates.remove(new_chosen)
 
-            if self._calc_token_num({new_chosen} | chosen) > self.max_source_tokens:
+            new_tokens = self._calc_token_num((new_chosen,))
+            if chosen_tokens + new_tokens > self.max_source_tokens:
                 out_sizes.add(new_chosen)
                 continue
             chosen.add(new_chosen)
-            candidates |= set(self._get_surrounding(new_chosen)) - chosen - out_sizes
+            chosen_tokens += new_tokens
+            self._vote_for_neighbors(new_chosen, votes)
+            candidates.update(
+                u
+                for u in self._get_surrounding(new_chosen)
+                if u not in chosen and u not in out_sizes
+            )
 
         return chosen
 
@@ -207,89 +272,120 @@ class EdgeCentricEngine(InteractEngine):
             yield await self._choose_to_trans()
 
     async def _synthesize_rust(self, all_segments: Iterable[CodeSegment]):
-        self._relations = set()
+        self._relations = {}
+        self._relation_list = []
+        self._out_adj = defaultdict(set)
+        self._in_adj = defaultdict(set)
         self._relation_try_count = defaultdict(int)
-        self._segment_timestamp = defaultdict(float)
+        self._segment_timestamp = WeakKeyDictionary()
+        self._synthesis_released = asyncio.Event()
         for segment in all_segments:
             for other in segment.use:
-                self._relations.add((segment, other))
+                self._insert_relation((segment, other))
             ## if there are standalone segments
             if not segment.use and not segment.used:
-                self._relations.add((segment, segment))
+                self._insert_relation((segment, segment))
 
         self._total_relation_num = len(self._relations)
-        self._bar = tqdm(total=self._total_relation_num, file=sys.stdout)
+        self._bar = tqdm(
+            total=self._total_relation_num, file=sys.stdout, mininterval=0.25
+        )
 
-        matcher = TreesitterMatcher(all_segments)
+        # the workspace already holds a matcher of all segments
+        matcher = self.workspace.matcher
 
         async def synthesize_for_segments(segments: set[CodeSegment]):
-            nonlocal matcher
-
             logger.info(f"Translating segment {' '.join(s.id for s in segments)}...")
 
-            trans_result = await self._sythesize_for_segments(segments)
-
-            match = matcher.try_to_match(trans_result)[0]
+            # release the segments even if the translation fails
+            try:
+                async with self._concurrency:
+                    trans_result = await self._sythesize_for_segments(segments)
 
-            to_add = []
-            for seg, pieces in match.items():
-                r = self.workspace.result_of_segment(seg) or ""
-                pieces_text = "\n".join(p.text for p in pieces)
+                matched = matcher.try_to_match(trans_result)
+                match = matched[0]
 
-                if interface_equal(r, pieces_text):
-                    continue
+                to_add = []
+                for seg, pieces in match.items():
+                    r = self.workspace.result_of_segment(seg) or ""
 
-                for dep in seg.used:
-                    if seg in segments and dep in segments:
-                        continue
-                    if seg not in segments and dep not in segments:
+                    # a segment without previous result never has an equal interface
+                    if r and interface_equal(r, "\n".join(p.text for p in pieces)):
                         continue
-                    to_add.append((dep, seg))
-
-            self._add_relation(to_add)
-
-            self.workspace.push(segments, trans_result)
-            self._in_synthesis -= segments
-            for s in segments:
-                self._segment_timestamp[s] = time.time()
-
-        tasks = []
-        async for i, segments in aenumerate(self._translate_order()):
-            to_remove = []
-            for s1, s2 in self._relations:
-                if s1 in segments and s2 in segments:
-                    to_remove.append((s1, s2))
-            self._remove_relation(to_remove)
-            self._in_synthesis |= segments
-
-            task = asyncio.create_task(synthesize_for_segments(segments))
-            tasks.append(task)
-        await asyncio.wait(tasks)
-        self._bar.close()
 
-    def _get_conflicts(self) -> dict[ConflictReport, set[RustPieceRef]]:
+                    for dep in seg.used:
+                        if seg in segments and dep in segments:
+                            continue
+                        if seg not in segments and dep not in segments:
+                            continue
+                        to_add.append((dep, seg))
+
+                self._add_relation(to_add)
+
+                # push the match above instead of parsing the same result again
+                self.workspace.push(segments, trans_result, matched)
+                for s in segments:
+                    self._segment_timestamp[s] = time.time()
+            finally:
+                self._in_synthesis -= segments
+                self._synthesis_released.set()
+
+        async with asyncio.TaskGroup() as tasks:
+            async for i, segments in aenumerate(self._translate_order()):
+                # relations inside the cluster, found via the adjacency index
+                to_remove = [
+                    (s1, s2) for s1 in segments for s2 in self._out_adj[s1] & segments
+                ]
+                self._remove_relation(to_remove)
+                self._in_synthesis |= segments
+
+                tasks.create_task(synthesize_for_segments(segments))
+        self._bar.close()
+        # the bookkeeping of this project is no longer needed
+        self._relation_try_count.clear()
+        self._segment_timestamp.clear()
+
+    # hash of the last validated translation and its conflicts
+    _validated: tuple[str, dict[ConflictReport, set[RustPieceRef]]] | None = None
+
+    async def _get_conflicts(self) -> dict[ConflictReport, set[RustPieceRef]]:
+        trans_result = self.workspace.trans_result()
+        trans_hash = calculate_md5(trans_result)
+        if self._validated and self._validated[0] == trans_hash:
+            # nothing changed since the last round, so cargo would say the same
+            return self._validated[1]
+        # cargo runs in worker threads so that the event loop is not blocked
+        self.workspace.config.dependencies = await asyncio.to_thread(
+            new_dependencies, trans_result, self.workspace.config.model_copy(deep=True)
+        )
         ranges: list[tuple[RustPieceRef, int, int]] = (
             self.workspace.rust_code.piece_ref_ranges()
         )
-        messages = validate(self.workspace.trans_result(), self.workspace.config)
+        messages = await asyncio.to_thread(
+            validate, trans_result, self.workspace.config.model_copy(deep=True)
+        )
         conflict2pieces = pieces_of_conflicts(messages, ranges)
+        self._validated = (trans_hash, conflict2pieces)
         return conflict2pieces
 
     async def _fix_grammar(self, rust_code: str) -> str:
-        if grammar_correct(rust_code):
+        if await self._grammar_correct(rust_code):
             return rust_code
-        messages = validate(rust_code, self.workspace.config)
+        messages = await asyncio.to_thread(
+            validate, rust_code, self.workspace.config.model_copy(deep=True)
+        )
         message_str = "\n".join(m.rendered for m in messages if m.rendered)
         raw_result = await self.agent.fix_grammar(
             rust_code, message_str, temperature=self.temperature
         )
-        result = self._collect_rust_code(raw_result) or ""
+        result = await self._rust_code_of(raw_result)
         return result
 
     async def _resolve_pieces_of_conflicts(
         self,
         conflicts: Iterable[ConflictReport],
-        pieces: set[RustPieceRef],
+        pieces: Set[RustPieceRef],
+        round: int = 0,
     ):
         err_msg = "\n".join(m.rendered for m in conflicts if m.rendered)
 
@@ -305,11 +401,14 @@ class EdgeCentricEngine(InteractEngine):
                 err_msg=err_msg,
                 rust_code="\n".join(trimmed.text),
                 temperature=self.temperature,
+                # a later round may ask the same again, if the answer of this
+                # one left the conflicts in place
+                attempt=round * GRAMMAR_RETRY + i,
             )
 
-            result = self._collect_rust_code(raw_result) or ""
+            result = await self._rust_code_of(raw_result)
 
-            if not grammar_correct(result):
+            if not await self._grammar_correct(result):
 
                 continue
             return result
@@ -319,53 +418,55 @@ class EdgeCentricEngine(InteractEngine):
 
     async def _resolve_conflicts_once(self, round: int) -> bool:
         in_resolution: set[RustPieceRef] = set()
+        resolution_released = asyncio.Event()
 
         async def resolve_pieces_of_conflicts(
             conflicts: list[ConflictReport],
-            pieces: set[RustPieceRef],
+            pieces: frozenset[RustPieceRef],
         ):
             nonlocal in_resolution, bar
             while pieces & in_resolution:
-                await asyncio.sleep(0.01)
+                resolution_released.clear()
+                await resolution_released.wait()
             in_resolution.update(pieces)
-            result = await self._resolve_pieces_of_conflicts(conflicts, pieces)
-            self.workspace.push(None, result)
-            in_resolution -= pieces
+            try:
+                result = await self._resolve_pieces_of_conflicts(
+                    conflicts, pieces, round
+                )
+                self.workspace.push(None, result)
+            finally:
+                in_resolution -= pieces
+                resolution_released.set()
             bar.update(len(conflicts))
 
-        tasks = []
-        self.workspace.config.dependencies = new_dependencies(
-            self.workspace.trans_result(), self.workspace.config
+        conflict2prefs: dict[ConflictReport, set[RustPieceRef]] = (
+            await self._get_conflicts()
         )
-
-        conflict2prefs: dict[ConflictReport, set[RustPieceRef]] = self._get_conflicts()
         if not conflict2prefs:
             logger.info(f"Round {round}: No conflicts found.")
             return True
         logger.info(f"Round {round}: Resolving {len(conflict2prefs)} conflicts...")
 
-        pref2conflicts = defaultdict(list)
-        conflicts_prefs: list[tuple[list[ConflictReport], set[RustPieceRef]]] = []
-
+        # conflicts on the same pieces (e.g. one error reported at several spans)
+        # are resolved together by a single request
+        prefs2conflicts: defaultdict[frozenset[RustPieceRef], list[ConflictReport]] = (
+            defaultdict(list)
+        )
         for conflict, prefs in conflict2prefs.items():
-            if not prefs:
-                continue
-            if len(prefs) > 1:
-                conflicts_prefs.append(([conflict], prefs))
-                continue
-            p = list(prefs)[0]
-            pref2conflicts[p].append(conflict)
-        for piece, conflicts in pref2conflicts.items():
-            conflicts_prefs.append((conflicts, {piece}))
+            if prefs:
+                prefs2conflicts[frozenset(prefs)].append(conflict)
+        conflicts_prefs = [
+            (conflicts, prefs) for prefs, conflicts in prefs2conflicts.items()
+        ]
         conflicts_prefs.reverse()
         bar = tqdm(total=len(conflict2prefs), file=sys.stdout)
-        for i, (conflicts, prefs) in enumerate(conflicts_prefs):
-
-            tasks.append(
-                asyncio.create_task(resolve_pieces_of_conflicts(conflicts, prefs))
-            )
-        await asyncio.wait(tasks)
-        bar.close()
+        # unlike asyncio.wait, a TaskGroup raises the first failure and cancels the rest
+        try:
+            async with asyncio.TaskGroup() as tasks:
+                for conflicts, prefs in conflicts_prefs:
+                    tasks.create_task(resolve_pieces_of_conflicts(conflicts, prefs))
+        finally:
+            bar.close()
         return False
 
     async def _resolve_conflicts(self):
@@ -382,6 +483,8 @@ class EdgeCentricEngine(InteractEngine):
             edition="2024",
             authors=["Your Name <youremail@example.com>"],
         )
+        self._in_synthesis = set()
+        self._validated = None
         segments = self._get_segments()
         self.workspace.set_segments(segments)
         await self._synthesize_rust(segments)
@@ -1,12 +1,16 @@
+import asyncio
 from abc import ABC, abstractmethod
-from collections.abc import Iterable
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
 import logging
 from typing import TYPE_CHECKING
+from weakref import WeakKeyDictionary
 
 from llm_c2rust.llm.LLM import Agent
 from llm_c2rust.core.transpilation_workspace import TranslationWorkspace
 from llm_c2rust.llm.api_inference import AsyncAPIInference
 from llm_c2rust.llm.uni_tokenizer import UniTokenizer
+from llm_c2rust.parser.rust_parser import grammar_correct
 from llm_c2rust.segmenter.code_segment import CodeSegment
 from llm_c2rust.segmenter.segmenter import Segmenter
 
@@ -16,10 +20,15 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger(__name__)
 
+# parses LLM responses off the event loop; apart from the default executor,
+# whose threads may all be waiting for a cargo build
+_parse_pool = ThreadPoolExecutor(thread_name_prefix="rust-parse")
+
 
 # just a wrapper of interactly translating
 class InteractEngine(ABC):
     temperature: float
+    _collect_rust_code: Callable[[str], str | None]
 
     def __init__(
         self,
@@ -28,12 +37,17 @@ class InteractEngine(ABC):
         token_num: int,
         token_num_method: str,
         temperature: float,
+        max_concurrency: int = 16,
     ):
         self.segmenter = segmenter
 
         self.max_source_tokens = token_num
         self.tokenizer = UniTokenizer(token_num_method)
         self.temperature = temperature
+        # weak, so the segments of finished projects are not kept alive
+        self._segment_tokens: WeakKeyDictionary[CodeSegment, int] = WeakKeyDictionary()
+        # bounds the translations talking to the LLM at the same time
+        self._concurrency = asyncio.Semaphore(max_concurrency)
 
     @property
     @abstractmethod
@@ -50,9 +64,40 @@ class InteractEngine(ABC):
 
     _project: "ProjectTranspiler"
 
+    def _segment_token_num(self, segment: CodeSegment) -> int:
+        # segments are immutable once segmented, so their token numbers are memoized
+        if (num := self._segment_tokens.get(segment)) is None:
+            num = self.tokenizer.token_num(segment.text)
+            self._segment_tokens[segment] = num
+        return num
+
+    def _count_segment_tokens(self, segments: Iterable[CodeSegment]) -> None:
+        """
+        Memoize the token numbers of segments, encoding the new ones in one batch.
+        """
+        new = [s for s in dict.fromkeys(segments) if s not in self._segment_tokens]
+        for segment, num in zip(new, self.tokenizer.token_nums([s.text for s in new])):
+            self._segment_tokens[segment] = num
+
+    async def _rust_code_of(self, raw_result: str) -> str:
+        """
+        Returns the Rust code in an LLM response, parsed in a worker thread.
+        """
+        loop = asyncio.get_running_loop()
+        code = await loop.run_in_executor(
+            _parse_pool, self._collect_rust_code, raw_result
+        )
+        return code or ""
+
+    async def _grammar_correct(self, rust_code: str) -> bool:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_parse_pool, grammar_correct, rust_code)
+
     def _get_segments(self) -> Iterable[CodeSegment]:
         logger.info("generating slices, waiting...")
         segments = self.segmenter.segment()
+        # every segment is counted sooner or later
+        self._count_segment_tokens(segments)
 
         return segments
 
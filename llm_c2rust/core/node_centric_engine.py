@@ -1,15 +1,14 @@
 import asyncio
 import logging
 import sys
-from collections import defaultdict
-from collections.abc import AsyncGenerator, Generator, Iterable
+from collections import Counter
+from collections.abc import AsyncGenerator, Generator, Iterable, MutableMapping
 from typing import TYPE_CHECKING
 
 import networkx as nx
 from tqdm import tqdm
 
 from llm_c2rust.llm.LLM import NodeCentricAgent
-from llm_c2rust.analyzer.matcher import TreesitterMatcher
 from llm_c2rust.analyzer.rust_pieces import RustCode
 
 from llm_c2rust.cargo.cargo_message import Package
@@ -21,11 +20,13 @@ from llm_c2rust.core.utils import (
     validate,
     first_rust_code_from_md,
     new_dependencies,
+    merge_dependencies,
     ConflictReport,
 )
 from llm_c2rust.llm.api_inference import AsyncAPIInference
 from llm_c2rust.segmenter.code_segment import CodeSegment
 from llm_c2rust.segmenter.segmenter import Segmenter
+from llm_c2rust.utils.hash import calculate_md5
 
 if TYPE_CHECKING:
     from llm_c2rust.core.transpiler import ProjectTranspiler
@@ -49,14 +50,24 @@ class NodeCentricEngine(InteractEngine):
         token_num_method: str,
         max_resolve_round: int,
         temperature: float,
+        max_concurrency: int = 16,
+        response_cache: MutableMapping[str, str] | None = None,
     ):
         super().__init__(
-            segmenter, predicator, token_num, token_num_method, temperature
+            segmenter,
+            predicator,
+            token_num,
+            token_num_method,
+            temperature,
+            max_concurrency,
         )
         self.max_resolve_round = max_resolve_round
         self._trans_manager = NodeCentricWorkspace()
-        self._agent = NodeCentricAgent(predicator)
-        self._translate_finished: list[CodeSegment] = []
+        self._agent = NodeCentricAgent(predicator, response_cache)
+        # guards the merge of the dependencies found by concurrent builds
+        self._dependencies_lock = asyncio.Lock()
+        # batches of segments whose translation finished, for _translate_order
+        self._translate_finished: asyncio.Queue[list[CodeSegment]] = asyncio.Queue()
         if predicator.model_name.startswith("qwen"):
             # Qwen like to split the answer into multiple parts
             self._collect_rust_code = all_rust_code_from_md
@@ -68,13 +79,20 @@ class NodeCentricEngine(InteractEngine):
     ) -> list[ConflictReport]:
         full_code = context + "\n" + rust_code
 
-        self.workspace.config.dependencies = new_dependencies(
-            full_code, self.workspace.config
+        # cargo runs in worker threads so that the other segments keep going
+        found = await asyncio.to_thread(
+            new_dependencies, full_code, self.workspace.config.model_copy(deep=True)
         )
+        # other segments may have added dependencies while cargo ran
+        async with self._dependencies_lock:
+            config = self.workspace.config
+            config.dependencies = merge_dependencies(config.dependencies, found)
         start_line = 1 + context.count("\n")  # 1-based
 
         msgs = []
-        for msg in validate(full_code, self.workspace.config):
+        for msg in await asyncio.to_thread(
+            validate, full_code, self.workspace.config.model_copy(deep=True)
+        ):
             if all(span.line_end < start_line for span in msg.all_spans):
                 continue
             msgs.append(msg)
@@ -96,10 +114,12 @@ class NodeCentricEngine(InteractEngine):
             source=source_code, dependency_summary=deps, temperature=self.temperature
         )
 
-        trans_result = self._collect_rust_code(raw_result) or ""
+        trans_result = await self._rust_code_of(raw_result)
 
         # examinate all segments are translated
-        match, trans_result = TreesitterMatcher(segments).try_to_match(trans_result)
+        match, trans_result = self.workspace.matcher_of(segments).try_to_match(
+            trans_result
+        )
         not_translated = [s for s in segments if s not in match]
         if not_translated:
 
@@ -112,7 +132,7 @@ class NodeCentricEngine(InteractEngine):
             )
 
             trans_result.merge_in(
-                RustCode.from_text(self._collect_rust_code(raw_result) or "")
+                RustCode.from_text(await self._rust_code_of(raw_result))
             )
         trans_result = trans_result.text
 
@@ -124,10 +144,9 @@ class NodeCentricEngine(InteractEngine):
 
         selected = []
         remain_tokens_num = TOKENS_FOR_CONFLICT
-        for msg in msgs:
-            if not msg.rendered:
-                continue
-            token_num = self.tokenizer.token_num(msg.rendered)
+        msgs = [msg for msg in msgs if msg.rendered]
+        token_nums = self.tokenizer.token_nums([msg.rendered for msg in msgs])
+        for msg, token_num in zip(msgs, token_nums):
             if token_num > remain_tokens_num:
                 yield selected
                 selected = []
@@ -144,8 +163,16 @@ class NodeCentricEngine(InteractEngine):
     ) -> str:
         result: RustCode = RustCode.from_text(trans_result)
 
+        validated: tuple[str, list[ConflictReport]] | None = None
         for i in range(self.max_resolve_round):
-            msgs = await self._get_conflicts(self.workspace.trans_result(), result.text)
+            context = self.workspace.trans_result()
+            code_hash = calculate_md5(context + "\0" + result.text)
+            if validated and validated[0] == code_hash:
+                # the last round changed nothing, so cargo would say the same
+                msgs = validated[1]
+            else:
+                msgs = await self._get_conflicts(context, result.text)
+                validated = (code_hash, msgs)
 
             if not msgs:
                 break
@@ -159,34 +186,35 @@ class NodeCentricEngine(InteractEngine):
                     err_msg=selected_msg_text,
                     rust_code=result.text,
                     temperature=self.temperature,
+                    # the same request comes again if the last round's
+                    # answer did not fix the conflicts
+                    attempt=i,
                 )
 
-                code = self._collect_rust_code(resp) or ""
+                code = await self._rust_code_of(resp)
                 result.merge_in(RustCode.from_text(code))
 
         return result.text
 
     async def _transpile_segments(self, segments: list[CodeSegment]) -> str:
 
-        trans_res = await self._sythesize_for_segments(segments)
+        async with self._concurrency:
+            trans_res = await self._sythesize_for_segments(segments)
 
-        trans_res = await self._resolve_conflicts(segments, trans_res)
+            trans_res = await self._resolve_conflicts(segments, trans_res)
         self.workspace.push(segments, trans_res)
-        self._translate_finished.extend(segments)
+        self._translate_finished.put_nowait(segments)
         return trans_res
 
     async def _translate_order(
         self, segments: list[CodeSegment]
     ) -> AsyncGenerator[list[CodeSegment]]:
 
-        def scc_token_num(segments: Iterable[CodeSegment]) -> int:
-            return sum(self.tokenizer.token_num(s.text) for s in segments)
-
         def pick_scc(
             sccs: Iterable[frozenset[CodeSegment]], tokens_limit: int
         ) -> frozenset[CodeSegment] | None:
             for scc in sccs:
-                if scc_token_num(scc) < tokens_limit:
+                if scc_tokens[scc] < tokens_limit:
                     return scc
 
         def find_new_leaves(
@@ -195,9 +223,8 @@ class NodeCentricEngine(InteractEngine):
             seg2scc: dict[CodeSegment, frozenset[CodeSegment]],
         ):
             new_leaves = set()
-            for s in finished:
-                for used in s.used:
-                    scc = seg2scc[used]
+            for finished_scc in {seg2scc[s] for s in finished}:
+                for scc in scc_dependents[finished_scc]:
                     indegree[scc] -= 1
                     if indegree[scc] == 0:
                         new_leaves.add(scc)
@@ -213,15 +240,24 @@ class NodeCentricEngine(InteractEngine):
         scc_of_segment: dict[CodeSegment, frozenset[CodeSegment]] = {
             s: scc for scc in sccs for s in scc
         }
+        scc_tokens: dict[frozenset[CodeSegment], int] = {
+            scc: sum(self._segment_token_num(s) for s in scc) for scc in sccs
+        }
 
-        # sum of in_degree of all nodes in a scc, except inner edges
-        # when a scc is ready, indegree == 0
-        # when a scc is translated, indegree < 0
-        scc_indegree: dict[frozenset[CodeSegment], int] = defaultdict(int)
+        # other sccs using a scc, i.e. the deduplicated cross-scc edges
+        scc_dependents: dict[frozenset[CodeSegment], set[frozenset[CodeSegment]]] = {
+            scc: set() for scc in sccs
+        }
         for u in segments:
-            scc_u = scc_of_segment[u]
-            uses = [v for v in u.use if scc_of_segment[v] != scc_u]
-            scc_indegree[scc_u] += len(uses)
+            for v in u.use:
+                if scc_of_segment[v] != scc_of_segment[u]:
+                    scc_dependents[scc_of_segment[v]].add(scc_of_segment[u])
+
+        # number of other sccs that a scc uses and are not translated yet
+        # when a scc is ready, indegree == 0
+        scc_indegree: dict[frozenset[CodeSegment], int] = Counter(
+            d for dependents in scc_dependents.values() for d in dependents
+        )
 
         # an scc is either leaves, translating, to_trans, and not ready.
         # not ready -- indegree=0 --> leaves --> to_trans --> translating --> translated
@@ -231,13 +267,15 @@ class NodeCentricEngine(InteractEngine):
         translating: set[CodeSegment] = set()
 
         while leaves or translating:
-            leaves.update(
-                find_new_leaves(self._translate_finished, scc_indegree, scc_of_segment)
-            )
-            translating.difference_update(self._translate_finished)
-            self._translate_finished = []
+            finished: list[CodeSegment] = []
+            if not leaves:
+                # nothing is ready, wait until a translating batch finishes
+                finished.extend(await self._translate_finished.get())
+            while not self._translate_finished.empty():
+                finished.extend(self._translate_finished.get_nowait())
+            leaves.update(find_new_leaves(finished, scc_indegree, scc_of_segment))
+            translating.difference_update(finished)
             if not leaves:
-                await asyncio.sleep(0.1)
                 continue
 
             to_trans: list[CodeSegment] = list(leaves.pop())
@@ -246,7 +284,7 @@ class NodeCentricEngine(InteractEngine):
                 picked = pick_scc(leaves, self.max_source_tokens - tokens_sum)
                 if not picked:
                     break
-                tokens_sum += scc_token_num(picked)
+                tokens_sum += scc_tokens[picked]
                 leaves.remove(picked)
                 to_trans.extend(picked)
 
@@ -271,13 +309,12 @@ class NodeCentricEngine(InteractEngine):
             file=sys.stdout,
         )
 
-        tasks = []
-        async for i, to_trans in aenumerate(self._translate_order(segments)):
+        async with asyncio.TaskGroup() as tasks:
+            async for i, to_trans in aenumerate(self._translate_order(segments)):
 
-            tasks.append(asyncio.create_task(self._transpile_segments(to_trans)))
-            logger.info(f"Translating { ', '.join(str(s.id) for s in to_trans)}")
-            bar.update(len(to_trans))
-        await asyncio.wait(tasks)
+                tasks.create_task(self._transpile_segments(to_trans))
+                logger.info(f"Translating { ', '.join(str(s.id) for s in to_trans)}")
+                bar.update(len(to_trans))
         bar.close()
 
     @property
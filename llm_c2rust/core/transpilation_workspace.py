@@ -4,11 +4,11 @@
 # their results
 
 from abc import ABC, abstractmethod
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 from collections.abc import Iterable
 import logging
 
-from llm_c2rust.analyzer.matcher import TreesitterMatcher
+from llm_c2rust.analyzer.matcher import Match, TreesitterMatcher
 from llm_c2rust.analyzer.rust_pieces import RustCode, RustUse
 from llm_c2rust.analyzer.utils import RustExtendable, RustPiece, RustSplittable
 from llm_c2rust.cargo.cargo_message import CargoConfig
@@ -43,19 +43,37 @@ class EdgeCentricWorkspace(TranslationWorkspace):
         self.seg_to_pieces: dict[CodeSegment, list[RustPiece]] = defaultdict(list)
         self.seg_of_pieces: dict[RustPiece, list[CodeSegment]] = defaultdict(list)
         self.rust_code = RustCode.from_text("")
+        # texts of result_of_segment, valid until the next push
+        self._segment_texts: dict[CodeSegment, str] = {}
 
     def set_segments(self, segments: Iterable[CodeSegment]):
         self.all_segments = set(segments)
         self.matcher = TreesitterMatcher(self.all_segments)
+        self._segment_texts.clear()
 
     def result_of_segment(self, segment: CodeSegment) -> str | None:
-        return "\n".join(p.text for p in self.seg_to_pieces[segment])
+        if (text := self._segment_texts.get(segment)) is None:
+            text = "\n".join(p.text for p in self.seg_to_pieces.get(segment, ()))
+            self._segment_texts[segment] = text
+        return text
 
-    def push(self, segments: set[CodeSegment] | None, code: str):
+    def push(
+        self,
+        segments: set[CodeSegment] | None,
+        code: str,
+        matched: tuple[Match, RustCode] | None = None,
+    ):
+        """
+        Args:
+            matched: the result of `self.matcher.try_to_match(code)` if the caller
+                already has it, which saves parsing the code again. It is consumed.
+        """
         if segments is None:
             segments = self.all_segments
 
-        match, new_code = self.matcher.try_to_match(code)
+        match, new_code = matched or self.matcher.try_to_match(code)
+        # merging changes shared pieces too, so every cached text may be stale
+        self._segment_texts.clear()
 
         for segment, pieces in match.items():
 
@@ -79,6 +97,14 @@ class EdgeCentricWorkspace(TranslationWorkspace):
             str: related function signatures
         """
         matched_pieces = {p for s in segments for p in self.seg_to_pieces[s]}
+        # ids of all pieces containing a matched piece, the same identity test as
+        # RustExtendable.contains, gathered in one walk up from each matched piece
+        containers: set[int] = set()
+        for p in matched_pieces:
+            parent = p.parent
+            while parent is not None and id(parent) not in containers:
+                containers.add(id(parent))
+                parent = parent.parent
         included: list[RustPiece] = []
 
         for item in self.rust_code.items:
@@ -91,24 +117,51 @@ class EdgeCentricWorkspace(TranslationWorkspace):
                 if spl:
                     included.append(spl)
             elif isinstance(item, RustExtendable):
-                if any(item.contains(p) for p in matched_pieces):
+                if id(item) in containers:
                     included.append(item)
-        used_rp = [
+        used_rp = {
             rp for s in segments for used in s.use for rp in self.seg_to_pieces[used]
-        ]
+        }
         trimmed = self.rust_code.trimmed(used_rp)
         signatures = trimmed.summary if trimmed else ""
         return "\n".join(item.text for item in included).strip(), signatures
 
 
 class NodeCentricWorkspace(TranslationWorkspace):
+    # more than the segment groups in translation at the same time
+    MATCHER_CACHE_SIZE = 64
+
     def __init__(self):
         super().__init__()
         self._segment_results: dict[CodeSegment, RustCode] = {}
+        # text and summary of each result, dropped when the result is replaced
+        self._segment_texts: dict[CodeSegment, tuple[str, str]] = {}
+        # text of trans_result, valid until the next push
+        self._trans_text: str | None = None
         self._use_decls: RustCode = RustCode.from_text("")
+        self._matchers: OrderedDict[frozenset[CodeSegment], TreesitterMatcher] = (
+            OrderedDict()
+        )
 
     def set_segments(self, segments: Iterable[CodeSegment]):
         self.all_segments = set(segments)
+        self._matchers.clear()
+        self._segment_texts.clear()
+
+    def matcher_of(self, segments: Iterable[CodeSegment]) -> TreesitterMatcher:
+        """
+        Returns the matcher of the segments, built once and shared by the
+        translation of the segments and the push of its result.
+        """
+        key = frozenset(segments)
+        if (matcher := self._matchers.get(key)) is not None:
+            self._matchers.move_to_end(key)
+            return matcher
+        matcher = TreesitterMatcher(key)
+        self._matchers[key] = matcher
+        if len(self._matchers) > self.MATCHER_CACHE_SIZE:
+            self._matchers.popitem(last=False)
+        return matcher
 
     def push(
         self,
@@ -117,36 +170,57 @@ class NodeCentricWorkspace(TranslationWorkspace):
     ) -> None:
         if not segments:
             return
-        match, rust_code = TreesitterMatcher(segments).try_to_match(code)
+        match, rust_code = self.matcher_of(segments).try_to_match(code)
+        self._trans_text = None
         for segment, pieces in match.items():
             self._segment_results[segment] = RustCode.from_text(
                 "\n".join(p.text for p in pieces)
             )
+            self._segment_texts.pop(segment, None)
         for p in rust_code.items:
             if isinstance(p, RustUse):
                 self._use_decls.add(p)
 
     def trans_result(self) -> str:
-        all_code = self._use_decls.copy()
-        for code in self._segment_results.values():
-            all_code.merge_in(code.copy())
-        return all_code.text
+        # merging is destructive, hence the copies; the merged text is kept
+        # since every conflict resolution round asks for it again
+        if self._trans_text is None:
+            all_code = self._use_decls.copy()
+            for code in self._segment_results.values():
+                all_code.merge_in(code.copy())
+            self._trans_text = all_code.text
+        return self._trans_text
 
     def result_of_segment(self, segment: CodeSegment) -> str:
-        if segment not in self._segment_results:
-            return ""
-        return self._segment_results[segment].text
+        texts = self._texts_of_segment(segment)
+        return texts[0] if texts else ""
+
+    def _texts_of_segment(self, segment: CodeSegment) -> tuple[str, str] | None:
+        if (texts := self._segment_texts.get(segment)) is None:
+            if (code := self._segment_results.get(segment)) is None:
+                return None
+            texts = self._segment_texts[segment] = (code.text, code.summary)
+        return texts
+
+    def texts_of_dependency(self, segments: Iterable[CodeSegment]) -> tuple[str, str]:
+        """
+        Returns:
+            tuple[str, str]: dependencies' results and their signatures
+        """
+        # each dependency once; both texts list them in the same order
+        deps = dict.fromkeys(dep for s in segments for dep in s.use)
+        texts = [self._texts_of_segment(d) for d in deps]
+        return (
+            "\n".join(t[0] if t else "" for t in texts),
+            "\n".join(t[1] for t in texts if t),
+        )
 
     def result_of_dependency(self, segments: Iterable[CodeSegment]) -> str:
-        deps = {dep for s in segments for dep in s.use}
-        return "\n".join(self.result_of_segment(dep) or "" for dep in deps)
+        return self.texts_of_dependency(segments)[0]
 
     def summary_of_dependency(self, segments: Iterable[CodeSegment]) -> str:
         """
         Returns:
             str: dependencies' signatures
         """
-        deps = {dep for s in segments for dep in s.use}
-        return "\n".join(
-            code.summary for d in deps if (code := self._segment_results.get(d))
-        )
+        return self.texts_of_dependency(segments)[1]
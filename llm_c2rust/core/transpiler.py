@@ -52,4 +52,7 @@ class ProjectTranspiler(object):
             engine.workspace.trans_result(),
         )
 
-        logger.info(f"Translate project {self.project_name} done.")
+        logger.info(
+            f"Translate project {self.project_name} done, "
+            f"{engine.agent.predicator.completion_tokens} completion tokens generated."
+        )
@@ -1,12 +1,15 @@
-import json
 import os
 import re
 import subprocess
 import tempfile
-from collections.abc import AsyncGenerator, AsyncIterable
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections.abc import AsyncGenerator, AsyncIterable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 from typing import TypeVar
 
-import requests
+import httpx
 
 from llm_c2rust.analyzer.utils import RustPieceRef
 from llm_c2rust.autobuild.clang_build import create_build_script
@@ -18,7 +21,11 @@ from llm_c2rust.cargo.rustc_messages import (
     CargoMessageTypeAdapter,
     RustcErrorMessages,
 )
-from llm_c2rust.cargo.cargo_message import CargoConfig, Dependency, write_cargo_config
+from llm_c2rust.cargo.cargo_message import (
+    CargoConfig,
+    Dependency,
+    encode_cargo_config,
+)
 from llm_c2rust.parser.rust_parser import grammar_correct
 from llm_c2rust.utils.markdown import extract_code_blocks_with_language
 
@@ -34,21 +41,43 @@ async def aenumerate(
         id += 1
 
 
+# one client shares a single HTTP/2 connection to crates.io between lookups,
+# including the concurrent ones of `new_dependencies`
+_crates_io = httpx.Client(http2=True, timeout=5.0)
+# crate name -> answer of crates.io, only for definitive answers
+_crate_versions: dict[str, tuple[str, str] | None] = {}
+
+
 def fetch_name_version(crate_name: str) -> tuple[str, str] | None:
     """
     Check if a crate exists on crates.io by sending a GET request
-    to the crates.io API endpoint.
+    to the crates.io API endpoint. Answers are cached for the whole process.
 
     Args:
         crate_name (str): The name of the crate to search for.
 
     Returns:
-        bool: True if the crate exists, False otherwise.
+        tuple[str, str] | None: The crate's canonical name and latest version,
+        or None if it does not exist or crates.io could not be reached.
     """
+    if crate_name in _crate_versions:
+        return _crate_versions[crate_name]
+    name_version = _fetch_name_version(crate_name)
+    if name_version is not False:
+        _crate_versions[crate_name] = name_version
+        return name_version
+    return None
+
+
+def _fetch_name_version(crate_name: str) -> tuple[str, str] | None | bool:
+    # returns None if the crate does not exist, and False if crates.io gave
+    # no definitive answer
     url = f"https://crates.io/api/v1/crates/{crate_name}"
     for i in range(3):
+        if i:
+            time.sleep(2**i)
         try:
-            response = requests.get(url)
+            response = _crates_io.get(url)
             # A successful API call returns status code 200 when the crate exists.
             if response.status_code == 200:
                 data = response.json()
@@ -63,21 +92,38 @@ def fetch_name_version(crate_name: str) -> tuple[str, str] | None:
                         continue
                     return crate_name, version_num
                 return None
+            elif response.status_code == 404:
+                return None
             else:
-                # Handle any unexpected status codes
+                # rate limits and server errors are retried, never cached
                 print(f"Received unexpected status code: {response.status_code}")
-                return None
 
-        except requests.RequestException as e:
+        except (httpx.HTTPError, ValueError) as e:
             print(f"An error occurred while making the request: {e}")
+    return False
+
+
+def _write_if_changed(path: str, data: bytes) -> None:
+    # an unchanged file is left alone, e.g. lib.rs when only Cargo.toml changed
+    try:
+        if os.path.getsize(path) == len(data):
+            with open(path, "rb") as f:
+                if f.read() == data:
+                    return
+    except FileNotFoundError:
+        pass
+    with open(path, "wb") as f:
+        f.write(data)
 
 
 def write_project(output_path: str, config: CargoConfig, code: str) -> None:
-    write_cargo_config(config, os.path.join(output_path, "Cargo.toml"))
+    src_path = os.path.join(output_path, "src")
+    _write_if_changed(
+        os.path.join(output_path, "Cargo.toml"), encode_cargo_config(config).encode()
+    )
     # Write Files
-    os.makedirs(os.path.join(output_path, "src"), exist_ok=True)
-    with open(os.path.join(output_path, "src", "lib.rs"), "w", encoding="utf-8") as f:
-        f.write(code)
+    os.makedirs(src_path, exist_ok=True)
+    _write_if_changed(os.path.join(src_path, "lib.rs"), code.encode())
 
 
 class RustBuildError(Exception):
@@ -86,9 +132,22 @@ class RustBuildError(Exception):
         self.message = message
 
 
-def build_project(project_path):
+# builds run from worker threads, at most one per CPU so they do not thrash
+_cargo_slots = threading.BoundedSemaphore(os.cpu_count() or 1)
 
-    rt = subprocess.run(
+
+def build_project(
+    project_path, reasons: Iterable[str] | None = None
+) -> Iterator[CargoMessage]:
+    """
+    Builds the project, yielding the messages of cargo as they are printed.
+
+    Args:
+        reasons: if given, only messages with one of these reasons are parsed and yielded.
+    """
+    # cargo prints compact JSON, so a reason can be found without parsing
+    markers = None if reasons is None else [f'"{r}"'.encode() for r in reasons]
+    with _cargo_slots, subprocess.Popen(
         [
             "cargo",
             "build",
@@ -98,51 +157,56 @@ def build_project(project_path):
             os.path.join(project_path, "Cargo.toml"),
         ],
         stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-    )
-
-    raw_messages = rt.stdout.split("\n")
-    messages: list[CargoMessage] = []
-    for message in raw_messages:
-        if message:
-            messages.append(
-                CargoMessageTypeAdapter.validate_python(json.loads(message))
-            )
-    return messages
+        stderr=subprocess.DEVNULL,
+    ) as proc:
+        assert proc.stdout is not None
+        for line in proc.stdout:
+            if not line.strip():
+                continue
+            if markers is not None and not any(m in line for m in markers):
+                continue
+            message = CargoMessageTypeAdapter.validate_json(line)
+            if reasons is None or message.reason in reasons:
+                yield message
 
 
 ConflictReport = RustcErrorMessages
 
+# the only cargo messages the callers of build_project look at
+COMPILER_MESSAGE = ("compiler-message",)
+
+_ABORTING = re.compile(r"error: aborting due to \d+ previous errors?")
+_IMPORT_ERRORS = [
+    re.compile(r"unresolved imports? `(\S+)`"),
+    re.compile(
+        r"failed to resolve: use of unresolved modules? or unlinked crates? `(\S+)`"
+    ),
+    re.compile(r"failed to resolve: .* `(\S+)` is not a crate or module"),
+]
+_CARGO_REGISTRY = re.compile(r".*/\.cargo/registry/src/.*/([\w-]+)-\d+\.\d+\.\d+/.*")
+_FEATURE_GATE = re.compile(r"the item is gated behind the `(.*)` feature")
+
 
 def validate(code: str, config: CargoConfig) -> list[ConflictReport]:
     tmpdir = tempfile.TemporaryDirectory()
     write_project(tmpdir.name, config, code)
     msgs: list[RustcErrorMessages] = []
-    for message in build_project(tmpdir.name):
+    for message in build_project(tmpdir.name, COMPILER_MESSAGE):
         if not isinstance(message, CargoMessageCompilerMessage):
             continue
         message = message.message
         if message.level != "error":
             continue
-        if re.match(r"error: aborting due to \d+ previous errors?", message.message):
+        if _ABORTING.match(message.message):
             continue
         msgs.append(message)
     return msgs
 
 
 def is_import_error(message: RustcErrorMessages) -> str | None:
-    if m := re.match(r"unresolved imports? `(\S+)`", message.message):
-        return m[1].split("::")[0]
-    if m := re.match(
-        r"failed to resolve: use of unresolved modules? or unlinked crates? `(\S+)`",
-        message.message,
-    ):
-        return m[1].split("::")[0]
-    if m := re.match(
-        r"failed to resolve: .* `(\S+)` is not a crate or module", message.message
-    ):
-        return m[1].split("::")[0]
+    for pattern in _IMPORT_ERRORS:
+        if m := pattern.match(message.message):
+            return m[1].split("::")[0]
 
 
 def new_dependencies(code: str, config: CargoConfig) -> dict[str, str | Dependency]:
@@ -153,20 +217,30 @@ def new_dependencies(code: str, config: CargoConfig) -> dict[str, str | Dependen
     # add dependencies
     tempdir = tempfile.TemporaryDirectory()
     write_project(tempdir.name, config, code)
+    messages = list(build_project(tempdir.name, COMPILER_MESSAGE))
 
-    for message in build_project(tempdir.name):
+    guess_names: dict[str, None] = {}  # ordered set
+    for message in messages:
         if not isinstance(message, CargoMessageCompilerMessage):
             continue
         message = message.message
-        if not (guess_name := is_import_error(message)):
-            continue
-        if not (name_version := fetch_name_version(guess_name)):
-            continue
-        real_name, version = name_version
-        config.dependencies[real_name] = Dependency(version=version)
+        if guess_name := is_import_error(message):
+            guess_names[guess_name] = None
+    # look up the distinct crates concurrently
+    added = False
+    with ThreadPoolExecutor() as pool:
+        for name_version in pool.map(fetch_name_version, guess_names):
+            if not name_version:
+                continue
+            real_name, version = name_version
+            config.dependencies[real_name] = Dependency(version=version)
+            added = True
     # add features
-    write_project(tempdir.name, config, code)
-    for message in build_project(tempdir.name):
+    if added:
+        write_project(tempdir.name, config, code)
+        messages = list(build_project(tempdir.name, COMPILER_MESSAGE))
+    # otherwise the project is unchanged, and so are the messages of the build
+    for message in messages:
         if not isinstance(message, CargoMessageCompilerMessage):
             continue
         message = message.message
@@ -174,18 +248,12 @@ def new_dependencies(code: str, config: CargoConfig) -> dict[str, str | Dependen
             if child.message != "found an item that was configured out":
                 continue
             if len(child.spans) == 0 or not (
-                m := re.match(
-                    r".*/\.cargo/registry/src/.*/([\w-]+)-\d+\.\d+\.\d+/.*",
-                    child.spans[0].file_name,
-                )
+                m := _CARGO_REGISTRY.match(child.spans[0].file_name)
             ):
                 continue
             crate_name = m[1]
             if i >= len(message.children) or not (
-                m := re.match(
-                    r"the item is gated behind the `(.*)` feature",
-                    message.children[i + 1].message,
-                )
+                m := _FEATURE_GATE.match(message.children[i + 1].message)
             ):
                 continue
 
@@ -201,6 +269,26 @@ def new_dependencies(code: str, config: CargoConfig) -> dict[str, str | Dependen
     return config.dependencies
 
 
+def merge_dependencies(
+    dependencies: dict[str, str | Dependency] | None,
+    found: dict[str, str | Dependency],
+) -> dict[str, str | Dependency]:
+    """
+    Merge the result of `new_dependencies` into the current dependencies,
+    keeping the crates and features added by other builds in the meantime.
+    """
+    merged = dict(dependencies or {})
+    for name, dep in found.items():
+        old = merged.get(name)
+        if old is None or isinstance(old, str):
+            merged[name] = dep
+        elif isinstance(dep, Dependency) and dep.features:
+            features = list(old.features or [])
+            features += [f for f in dep.features if f not in features]
+            merged[name] = old.model_copy(update={"features": features})
+    return merged
+
+
 def analyze_source(project_path, codeql_path, database_path):
     build_script_path = os.path.abspath(
         os.path.join(project_path, "llm_c2rust_build.sh")
@@ -218,34 +306,57 @@ def analyze_source(project_path, codeql_path, database_path):
     )
 
 
+# every Rust file with an item has one of these: an item keyword, a path,
+# an attribute or a macro invocation
+_RUST_TOKENS = re.compile(
+    r"\b(?:fn|let|use|impl|struct|enum|union|trait|type|mod|const|static|extern"
+    r"|macro_rules)\b|::|#!?\[|\w!\s*[({\[]"
+)
+
+
+def _likely_rust(content: str) -> bool:
+    # cheap check rejecting logs, shell output, JSON... before parsing them
+    return _RUST_TOKENS.search(content) is not None
+
+
 def first_rust_code_from_md(md_string: str):
     for lang, content in extract_code_blocks_with_language(md_string):
-        if lang == "rust" or grammar_correct(content):
+        if lang == "rust" or (_likely_rust(content) and grammar_correct(content)):
             return content
     return None
 
 
 def all_rust_code_from_md(md_string: str) -> str:
-    rust_code = ""
+    rust_code: list[str] = []
     for lang, content in extract_code_blocks_with_language(md_string):
         # strict check
-        if grammar_correct(content):
-            rust_code += content + "\n"
-    return rust_code
+        if _likely_rust(content) and grammar_correct(content):
+            rust_code.append(content + "\n")
+    return "".join(rust_code)
 
 
 def pieces_of_conflict(
-    message: ConflictReport, ranges: list[tuple[RustPieceRef, int, int]]
+    message: ConflictReport,
+    ranges: list[tuple[RustPieceRef, int, int]],
+    bounds: tuple[list[int], list[int]] | None = None,
 ) -> set[RustPieceRef]:
+    """
+    Args:
+        ranges: as returned by `RustCode.piece_ref_ranges`. They follow each other,
+            so both their start lines and their end lines are sorted.
+        bounds: the start lines and the end lines of `ranges`, if already computed.
+    """
+    starts, ends = bounds or ([r[1] for r in ranges], [r[2] for r in ranges])
     pieces = set()
     for span in message.all_spans:
         if span.file_name != "src/lib.rs":
             continue
-        for item, start_line, end_line in ranges:
-            if start_line <= span.line_start <= span.line_end <= end_line:
-                pieces.add(item)
-            if span.line_end < start_line:
-                break
+        if span.line_start > span.line_end:
+            continue
+        # ranges with start_line <= span.line_start and span.line_end <= end_line
+        lo = bisect_left(ends, span.line_end)
+        hi = bisect_right(starts, span.line_start)
+        pieces.update(ranges[i][0] for i in range(lo, hi))
     return pieces
 
 
@@ -253,7 +364,8 @@ def pieces_of_conflicts(
     messages: list[ConflictReport], ranges: list[tuple[RustPieceRef, int, int]]
 ) -> dict[ConflictReport, set[RustPieceRef]]:
     message_with_pieces: dict[ConflictReport, set[RustPieceRef]] = {}
+    bounds = [r[1] for r in ranges], [r[2] for r in ranges]
     for message in messages:
-        if pieces := pieces_of_conflict(message, ranges):
+        if pieces := pieces_of_conflict(message, ranges, bounds):
             message_with_pieces[message] = pieces
     return message_with_pieces
@@ -1,10 +1,87 @@
+import asyncio
+from collections.abc import MutableMapping
+
 from llm_c2rust.llm.api_inference import AsyncAPIInference
+from llm_c2rust.llm.response_cache import ResponseCache
+
+# The fixed instructions open every translation prompt, so that consecutive
+# requests share a long identical prefix that providers can cache.
+EDGE_CENTRIC_GUIDELINES = """I am translating a C project into Rust. Due to limited tokens, in each iteration I will only provide some of the code snippets—referred to as a 'context'. Since each snippet might have been translated before in different contexts, I am also including its previous translation results. Additionally, I will provide some already-translated function signatures for related functions as references.
+When translating, please follow these guidelines:
+- Only translate the code within the current context.
+- Use the provided previous translation and signatures of related functions as references.
+- Do not change parts of the previous translation that are unrelated to the current context unless absolutely necessary.
+- If you modified parts of previous translation, please leave sufficient comments around the changes to explain your modifications.
+- Your translation should be complete. Do not omit parts of the translation when they remain unchanged.
+Your goal is to ensure the translation remains consistent across contexts while accurately reflecting the current context.
+"""
+NODE_CENTRIC_GUIDELINES = """I am translating some code snippets of a C project into Rust. I will provide summary of translated dependencies as references.
+"""
 
 
 class Agent:
 
-    def __init__(self, predicator: AsyncAPIInference) -> None:
+    def __init__(
+        self,
+        predicator: AsyncAPIInference,
+        cache: MutableMapping[str, str] | None = None,
+    ) -> None:
         self.predicator = predicator
+        # e.g. a ResponseCache; only deterministic (temperature 0) responses
+        # are cached, so sampled ones stay fresh. A caller retrying after
+        # rejecting a response passes the number of the attempt, which is part
+        # of the key, so the retry is not answered with the rejected response.
+        self.cache = cache
+        # the deterministic requests being sent, by their cache key; the same
+        # request made again meanwhile waits for their response
+        self._inflight: dict[str, asyncio.Task[str]] = {}
+
+    async def _chat(
+        self,
+        messages: list[dict[str, str]],
+        max_tokens: int | None,
+        temperature: float,
+        attempt: int = 0,
+    ) -> str:
+        if temperature:
+            return (
+                await self.predicator.chat(
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                )
+                or ""
+            )
+        key = ResponseCache.key(
+            self.predicator.model_name, temperature, messages, max_tokens, attempt
+        )
+        if self.cache is not None and (cached := self.cache.get(key)) is not None:
+            return cached
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(
+                self._send(key, messages, max_tokens, temperature)
+            )
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shielded, so a cancelled caller does not cancel the others' request
+        return await asyncio.shield(task)
+
+    async def _send(
+        self,
+        key: str,
+        messages: list[dict[str, str]],
+        max_tokens: int | None,
+        temperature: float,
+    ) -> str:
+        llm_res = await self.predicator.chat(
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+        )
+        if llm_res and self.cache is not None:
+            self.cache[key] = llm_res
+        return llm_res or ""
 
     def calculate_message_length(self, messages):
         total_length = sum(
@@ -23,17 +100,10 @@ class EdgeCentricAgent(Agent):
         signatures: str,
         max_tokens: int | None = None,
         temperature: float = 0.0,
+        attempt: int = 0,
     ):
-        user_content = """I am translating a C project into Rust. Due to limited tokens, in each iteration I will only provide some of the code snippets—referred to as a 'context'. Since each snippet might have been translated before in different contexts, I am also including its previous translation results. Additionally, I will provide some already-translated function signatures for related functions as references.
-When translating, please follow these guidelines:
-- Only translate the code within the current context.
-- Use the provided previous translation and signatures of related functions as references.
-- Do not change parts of the previous translation that are unrelated to the current context unless absolutely necessary.
-- If you modified parts of previous translation, please leave sufficient comments around the changes to explain your modifications.
-- Your translation should be complete. Do not omit parts of the translation when they remain unchanged.
-Your goal is to ensure the translation remains consistent across contexts while accurately reflecting the current context.
-"""
-        user_content = "Source Code \n```\n" + source + "\n```\n"
+        user_content = EDGE_CENTRIC_GUIDELINES
+        user_content += "Source Code \n```\n" + source + "\n```\n"
 
         if previous_result:
             user_content += "Previous Translation:\n```rust\n"
@@ -56,12 +126,7 @@ Your goal is to ensure the translation remains consistent across contexts while
             },
             {"role": "user", "content": user_content},
         ]
-        llm_res = await self.predicator.chat(
-            messages=messages,
-            max_tokens=max_tokens,
-            temperature=temperature,
-        )
-        return llm_res or ""
+        return await self._chat(messages, max_tokens, temperature, attempt)
 
     async def resolve_conflicts(
         self,
@@ -69,6 +134,7 @@ Your goal is to ensure the translation remains consistent across contexts while
         rust_code: str,
         max_tokens: int | None = None,
         temperature: float = 0.0,
+        attempt: int = 0,
     ):
 
         user_content = (
@@ -89,12 +155,7 @@ Your goal is to ensure the translation remains consistent across contexts while
             },
             {"role": "user", "content": user_content},
         ]
-        llm_res = await self.predicator.chat(
-            messages=messages,
-            max_tokens=max_tokens,
-            temperature=temperature,
-        )
-        return llm_res or ""
+        return await self._chat(messages, max_tokens, temperature, attempt)
 
     async def fix_grammar(
         self,
@@ -102,6 +163,7 @@ Your goal is to ensure the translation remains consistent across contexts while
         err_msg: str,
         max_tokens: int | None = None,
         temperature: float = 0.0,
+        attempt: int = 0,
     ):
         user_content = (
             "I have a Rust code snippet that has some syntax errors and needs to be corrected. "
@@ -120,12 +182,7 @@ Your goal is to ensure the translation remains consistent across contexts while
             {"role": "user", "content": user_content},
         ]
 
-        llm_res = await self.predicator.chat(
-            messages=messages,
-            max_tokens=max_tokens,
-            temperature=temperature,
-        )
-        return llm_res or ""
+        return await self._chat(messages, max_tokens, temperature, attempt)
 
 
 class NodeCentricAgent(Agent):
@@ -136,9 +193,10 @@ class NodeCentricAgent(Agent):
         dependency_summary: str,
         max_tokens: int | None = None,
         temperature: float = 0.0,
+        attempt: int = 0,
     ):
-        user_content = """I am translating some code snippets of a C project into Rust. I will provide summary of translated dependencies as references. """
-        user_content = "Source Code \n```\n" + source + "\n```\n"
+        user_content = NODE_CENTRIC_GUIDELINES
+        user_content += "Source Code \n```\n" + source + "\n```\n"
 
         if dependency_summary:
             user_content += "Summary of dependencies:\n```rust\n"
@@ -155,12 +213,7 @@ class NodeCentricAgent(Agent):
             {"role": "user", "content": user_content},
         ]
 
-        llm_res = await self.predicator.chat(
-            messages=messages,
-            max_tokens=max_tokens,
-            temperature=temperature,
-        )
-        return llm_res or ""
+        return await self._chat(messages, max_tokens, temperature, attempt)
 
     async def resolve_conflicts(
         self,
@@ -168,6 +221,7 @@ class NodeCentricAgent(Agent):
         rust_code: str,
         max_tokens: int | None = None,
         temperature: float = 0.0,
+        attempt: int = 0,
     ):
 
         user_content = (
@@ -188,9 +242,4 @@ class NodeCentricAgent(Agent):
             {"role": "user", "content": user_content},
         ]
 
-        llm_res = await self.predicator.chat(
-            messages=messages,
-            max_tokens=max_tokens,
-            temperature=temperature,
-        )
-        return llm_res or ""
+        return await self._chat(messages, max_tokens, temperature, attempt)
@@ -1,14 +1,16 @@
 import asyncio
-import json
 import logging
+import random
+import re
 import time
 import traceback
-from collections.abc import AsyncGenerator, Callable, Generator, Iterable
-from types import CoroutineType
+from collections import deque
+from collections.abc import AsyncGenerator, Awaitable, Callable, Generator, Iterable
+from functools import partial
 from typing import Any, NamedTuple
 
+import httpx
 import openai
-from httpx import RemoteProtocolError
 from openai.types.chat.chat_completion import ChatCompletion
 from openai.types.chat.chat_completion_chunk import ChatCompletionChunk
 
@@ -23,35 +25,81 @@ from .uni_tokenizer import UniTokenizer
 
 logger: logging.Logger = logging.getLogger(__name__)
 
+# connection pool and timeouts of the HTTP clients talking to the LLM APIs;
+# a completion may take minutes before its first byte, hence the read timeout
+HTTP_LIMITS = httpx.Limits(
+    max_connections=256, max_keepalive_connections=64, keepalive_expiry=60
+)
+HTTP_TIMEOUT = httpx.Timeout(connect=10, read=600, write=30, pool=60)
+
+
+# the longest wait between two retries, in seconds
+MAX_BACKOFF = 600
+
+
+# errors worth retrying; the others (bad request, authentication...) would
+# fail again. httpx errors escape the SDK while a response is streamed.
+TRANSIENT_ERRORS = (
+    openai.APIConnectionError,  # including timeouts
+    openai.RateLimitError,
+    openai.InternalServerError,
+    httpx.TransportError,
+)
+# errors of the request itself, which every API key would get as well
+REQUEST_ERRORS = (
+    openai.BadRequestError,  # e.g. a prompt over the context length
+    openai.UnprocessableEntityError,
+    openai.NotFoundError,
+)
+# errors of the API key, which the other keys may not have
+KEY_ERRORS = (
+    openai.AuthenticationError,
+    openai.PermissionDeniedError,
+)
+
+
+def retry_after(e: Exception) -> float | None:
+    """
+    Return the wait asked for by the `Retry-After` header of an error, if any.
+    """
+    response = getattr(e, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
 
 async def retry_forever(
-    chat: Callable[[], CoroutineType[Any, Any, str | None]], tokens_num: int
+    chat: Callable[[], Awaitable[str | None]],
+    tokens_num: int,
+    max_attempts: int | None = None,
 ) -> str | None:
     sleep_time = 60
+    attempts = 0
 
-    async def bin_backoff_sleep():
+    async def bin_backoff_sleep(wait: float | None = None):
         nonlocal sleep_time
-        logger.error(f"Retrying in {sleep_time} seconds")
-        await asyncio.sleep(sleep_time)
-        sleep_time *= 2
+        if wait is None:
+            # full jitter, so that the requests failing together do not
+            # all come back at the same moment
+            wait = random.uniform(0, sleep_time)
+            sleep_time = min(sleep_time * 2, MAX_BACKOFF)
+        logger.error(f"Retrying in {wait:.1f} seconds")
+        await asyncio.sleep(wait)
 
     while True:
+        attempts += 1
         try:
             return await chat()
 
-        except openai.OpenAIError as e:
-            if getattr(e, "status_code", None) == 500:
-                logger.error(f"OpenAIError: {e}")
-                print("tokens num:", tokens_num)
-                await bin_backoff_sleep()
-                continue
-            else:
+        except TRANSIENT_ERRORS as e:
+            if max_attempts is not None and attempts >= max_attempts:
                 raise
-
-        except (RemoteProtocolError, json.JSONDecodeError):
-            logger.error(traceback.format_exc())
+            logger.error(f"{type(e).__name__}: {e}")
             print("tokens num:", tokens_num)
-            await bin_backoff_sleep()
+            await bin_backoff_sleep(retry_after(e))
             continue
 
 
@@ -77,7 +125,11 @@ class APIInference(LanguageModelPredictor):
         self.api_key: str = api_key
         self.base_url: str = base_url
         self.client: openai.OpenAI = openai.OpenAI(
-            api_key=self.api_key, base_url=self.base_url
+            api_key=self.api_key,
+            base_url=self.base_url,
+            http_client=httpx.Client(
+                limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT, http2=True
+            ),
         )
         self.tokenizer = UniTokenizer(self.model_name)
 
@@ -173,6 +225,72 @@ class Record(NamedTuple):
     timestamp: float
 
 
+class ClientPool:
+    """
+    The clients of an endpoint, one per API key.
+
+    Keys can be added and removed while requests are running. Each request
+    picks its first client at random in proportion to the weights of the keys;
+    a key rejected by the API (`KEY_ERRORS`) is left out for `EJECTION` seconds.
+    """
+
+    EJECTION = 60
+
+    def __init__(self, base_url: str, http_client: httpx.AsyncClient) -> None:
+        self.base_url = base_url
+        self.http_client = http_client
+        self._clients: dict[str, openai.AsyncOpenAI] = {}
+        self._weights: dict[str, float] = {}
+        self._ejected_until: dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    def add(self, api_key: str, weight: float = 1) -> None:
+        """
+        Add an API key, or change its weight.
+        """
+        if api_key not in self._clients:
+            self._clients[api_key] = openai.AsyncOpenAI(
+                api_key=api_key, base_url=self.base_url, http_client=self.http_client
+            )
+        self._weights[api_key] = weight
+
+    def remove(self, api_key: str) -> None:
+        # requests already holding its client finish with it
+        self._clients.pop(api_key, None)
+        self._weights.pop(api_key, None)
+        self._ejected_until.pop(api_key, None)
+
+    def in_turn(self) -> list[openai.AsyncOpenAI]:
+        """
+        Return the clients to try for a request, in order.
+
+        The first is picked by weight among the available clients, the other
+        available ones are its fallbacks, and the ejected ones come last.
+        """
+        now = time.monotonic()
+        available = [k for k in self._clients if self._ejected_until.get(k, 0.0) <= now]
+        ejected = [k for k in self._clients if k not in available]
+        if available:
+            first = random.choices(
+                available, weights=[self._weights[k] for k in available]
+            )[0]
+            available.remove(first)
+            available.insert(0, first)
+        return [self._clients[k] for k in available + ejected]
+
+    def report_error(self, client: openai.AsyncOpenAI, error: Exception) -> None:
+        if isinstance(error, KEY_ERRORS):
+            self._ejected_until[client.api_key] = time.monotonic() + self.EJECTION
+
+
+class StreamedResponse(NamedTuple):
+    text: str
+    # as reported by the provider, or else the number of content chunks
+    token_count: int
+
+
 def enforce_trailing_slash(url: str) -> str:
     """
     Enforce a trailing slash on a URL.
@@ -188,6 +306,37 @@ def enforce_trailing_slash(url: str) -> str:
     return url + "/"
 
 
+MARSHAL_INSTRUCTION = (
+    "You will be given several independent requests, each in a "
+    '<row id="N">...</row> element. Answer every request separately, '
+    'each answer in a <out id="N">...</out> element with the id of its '
+    "request. Do not write anything outside the <out> elements."
+)
+_MARSHALED_OUT = re.compile(r'<out id="?(\d+)"?>(.*?)</out>', re.DOTALL)
+
+
+def marshal_rows(prompts: Iterable[str]) -> str:
+    """
+    Pack several prompts into one, each wrapped in a row with its index.
+    """
+    return "\n".join(f'<row id="{i}">\n{p}\n</row>' for i, p in enumerate(prompts))
+
+
+def unmarshal_outputs(response: str, row_num: int) -> dict[int, str]:
+    """
+    Split a response to `marshal_rows` into the answers of its rows.
+
+    Returns:
+        The answer of each row found in the response, by the row's index.
+    """
+    outputs: dict[int, str] = {}
+    for m in _MARSHALED_OUT.finditer(response):
+        i = int(m[1])
+        if i < row_num:
+            outputs.setdefault(i, m[2].strip())
+    return outputs
+
+
 class AsyncAPIInference(AsyncLanguageModelPredictor):
     """
     A class for interacting with an LLM async API for a specific model.
@@ -202,6 +351,7 @@ class AsyncAPIInference(AsyncLanguageModelPredictor):
         tpm: int | None,
         default_max_tokens: int,
         reasoning: bool,
+        max_attempts: int | None = None,
     ):
         """
         Initialize the APIInference class.
@@ -210,21 +360,42 @@ class AsyncAPIInference(AsyncLanguageModelPredictor):
             model_name: The name of the LLM model to use.
             api_key: The API key for the LLM API.
             base_url: The base URL for the LLM API.
+            max_attempts: How many times a request is tried on each API key
+                before moving on, or None to retry transient errors forever.
         """
         self.model_name = model_name
         self.base_url = enforce_trailing_slash(base_url)
         self.api_keys = list(api_keys)
         self.qpm = qpm
         self.tpm = tpm
-        self.history: list[Record] = []
-
-        self.clients = [
-            openai.AsyncOpenAI(api_key=api_key, base_url=base_url)
-            for api_key in api_keys
-        ]
+        # the requests of the last 60 seconds, and the sum of their tokens
+        self._history: deque[Record] = deque()
+        self._token_sum = 0
+        # held by the request waiting for room in the window
+        self._waiting = asyncio.Lock()
+
+        # one connection pool for all the API keys of the endpoint
+        self.http_client = httpx.AsyncClient(
+            limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT, http2=True
+        )
+        self.clients = ClientPool(base_url, self.http_client)
+        for api_key in self.api_keys:
+            self.clients.add(api_key)
         self.tokenizer = UniTokenizer(self.model_name)
         self.default_max_tokens = default_max_tokens
         self.reasoning = reasoning
+        self.max_attempts = max_attempts
+        # sent with every request
+        if model_name.startswith("doubao"):
+            self._extra_body = {
+                "thinking": {
+                    "type": "disabled",
+                }
+            }
+        else:
+            self._extra_body = {}
+        # generated by the model so far, e.g. for cost reports
+        self.completion_tokens = 0
 
     def __repr__(self) -> str:
         """
@@ -246,63 +417,74 @@ class AsyncAPIInference(AsyncLanguageModelPredictor):
             raise Exception("The tokenizer is None")
         return self.tokenizer.token_num(text=text)
 
-    def wait_time(self, messages: list[dict[str, str]], max_tokens: int) -> float:
+    def _trim(self, current_time: float) -> None:
+        while self._history and current_time - self._history[0].timestamp > 60:
+            self._token_sum -= self._history.popleft().token_num
+
+    def wait_time(self, prompt_tokens: int, max_tokens: int) -> float:
 
-        current_time = time.time()
+        current_time = time.monotonic()
+        self._trim(current_time)
         # check if query times exceed
-        if self.qpm and len(self.history) >= self.qpm:
-            delta = current_time - self.history[-self.qpm].timestamp
-            if delta <= 60:
-                return 60 - delta
+        if self.qpm and len(self._history) >= self.qpm:
+            delta = current_time - self._history[-self.qpm].timestamp
+            return 60 - delta
         if self.tpm is None:
             return 0
-        token_num_sum = self.token_num(messages) + max_tokens
-        for record in reversed(self.history):
-            delta = current_time - record.timestamp
-            if delta > 60:
-                break
-            token_num_sum += record.token_num
-            if token_num_sum >= self.tpm:
-                return 60 - delta
+        excess = self._token_sum + prompt_tokens + max_tokens - self.tpm
+        if excess < 0:
+            return 0
+        # wait until enough of the oldest records leave the window
+        for record in self._history:
+            excess -= record.token_num
+            if excess < 0:
+                return 60 - (current_time - record.timestamp)
+        # the request alone exceeds the limit, so it waits for an empty window
+        if self._history:
+            return 60 - (current_time - self._history[-1].timestamp)
         return 0
 
     async def ready_to_go(
-        self, messages: list[dict[str, str]], max_tokens: int | None = None
+        self, prompt_tokens: int, max_tokens: int | None = None
     ) -> None:
         if max_tokens is None:
             max_tokens = self.default_max_tokens
-        while (wait_time := self.wait_time(messages, max_tokens)) > 0:
-            await asyncio.sleep(wait_time)
-        self.history.append(
-            Record(
-                token_num=self.token_num(messages) + max_tokens, timestamp=time.time()
-            )
+        # fast path: nobody is waiting and there is room in the window; there
+        # is no await between the check and the append below, so it is atomic
+        if self._waiting.locked() or self.wait_time(prompt_tokens, max_tokens) > 0:
+            # slow path: the waiting requests go one by one in arrival order, so
+            # a large request is not starved by the smaller ones coming after
+            async with self._waiting:
+                # the check is cheap, the tokens being counted by the caller; it
+                # is repeated since the window may fill up again during the sleep
+                while (wait_time := self.wait_time(prompt_tokens, max_tokens)) > 0:
+                    await asyncio.sleep(wait_time)
+        # monotonic, so the window does not move with the wall clock
+        record = Record(
+            token_num=prompt_tokens + max_tokens, timestamp=time.monotonic()
         )
+        self._history.append(record)
+        self._token_sum += record.token_num
 
     async def _chat_under_limit(
         self,
         client: openai.AsyncOpenAI,
         messages: list[dict[str, str]],
+        prompt_tokens: int,
         max_tokens: int | None = None,
         temperature: float | None = None,
         top_p: float | None = None,
     ):
-        await self.ready_to_go(messages, max_tokens)
-        if self.model_name.startswith("doubao"):
-            extra_body = {
-                "thinking": {
-                    "type": "disabled",
-                }
-            }
-        else:
-            extra_body = {}
+        await self.ready_to_go(prompt_tokens, max_tokens)
         outputs: ChatCompletion = await client.chat.completions.create(
             model=self.model_name,
             messages=messages,  # type:ignore
             temperature=temperature,
             top_p=top_p,
-            extra_body=extra_body,
+            extra_body=self._extra_body,
         )
+        if outputs.usage is not None:
+            self.completion_tokens += outputs.usage.completion_tokens
         return outputs.choices[0].message.content
 
     async def _chat(
@@ -313,15 +495,27 @@ class AsyncAPIInference(AsyncLanguageModelPredictor):
         top_p: float | None = None,
     ) -> str | None:
 
-        for client in self.clients:
+        # counted once, for all the clients and retries
+        prompt_tokens = self.token_num(messages)
+        for client in self.clients.in_turn():
             try:
                 return await retry_forever(
-                    lambda: self._chat_under_limit(
-                        client, messages, max_tokens, temperature, top_p
+                    partial(
+                        self._chat_under_limit,
+                        client,
+                        messages,
+                        prompt_tokens,
+                        max_tokens,
+                        temperature,
+                        top_p,
                     ),
-                    self.token_num(messages),
+                    prompt_tokens,
+                    self.max_attempts,
                 )
+            except REQUEST_ERRORS:
+                raise
             except Exception as e:
+                self.clients.report_error(client, e)
                 logger.error(traceback.format_exc())
                 continue
 
@@ -344,39 +538,111 @@ class AsyncAPIInference(AsyncLanguageModelPredictor):
         Returns:
             The response from the LLM.
         """
-        for client in self.clients:
-            if self.reasoning:
+        # counted once, for all the clients and retries
+        prompt_tokens = self.token_num(messages)
+        if self.reasoning:
+
+            async def chat_under_limit(*args: Any) -> str | None:
+                return (await self._chat_stream_under_limit(*args)).text
+
+        else:
+            chat_under_limit = self._chat_under_limit
+        clients = self.clients.in_turn()
+        for i, client in enumerate(clients):
+            try:
                 return await retry_forever(
-                    lambda: self._chat_stream_under_limit(
-                        client, messages, max_tokens, temperature, top_p
+                    partial(
+                        chat_under_limit,
+                        client,
+                        messages,
+                        prompt_tokens,
+                        max_tokens,
+                        temperature,
+                        top_p,
                     ),
-                    self.token_num(messages),
+                    prompt_tokens,
+                    self.max_attempts,
                 )
-            else:
-                return await retry_forever(
-                    lambda: self._chat_under_limit(
-                        client, messages, max_tokens, temperature, top_p
-                    ),
-                    self.token_num(messages),
+            except REQUEST_ERRORS:
+                # the other clients would fail the same way
+                raise
+            except Exception as e:
+                self.clients.report_error(client, e)
+                # the error of the last client is the error of the request
+                if i == len(clients) - 1:
+                    raise
+                logger.error(traceback.format_exc())
+
+    async def chat_marshaled(
+        self,
+        prompts: list[str],
+        batch_size: int,
+        max_tokens: int | None = None,
+        temperature: float | None = None,
+    ) -> list[str | None]:
+        """
+        Answer independent prompts, packing up to `batch_size` of them into
+        each request.
+
+        Fewer, larger requests save round trips and requests per minute, at
+        the cost of the latency of each request. The prompts a model leaves
+        unanswered are sent again on their own.
+
+        Args:
+            prompts: The prompts, each the content of a user message.
+            batch_size: The maximum number of prompts in one request.
+            max_tokens: The maximum number of tokens in each response.
+            temperature: The temperature to use for the responses.
+
+        Returns:
+            The answers, in the order of `prompts`.
+        """
+
+        def user_message(prompt: str) -> list[dict[str, str]]:
+            return [{"role": "user", "content": prompt}]
+
+        async def chat_batch(batch: list[str]) -> list[str | None]:
+            if len(batch) == 1:
+                return [
+                    await self.chat(user_message(batch[0]), max_tokens, temperature)
+                ]
+            response = await self.chat(
+                [
+                    {"role": "system", "content": MARSHAL_INSTRUCTION},
+                    {"role": "user", "content": marshal_rows(batch)},
+                ],
+                max_tokens,
+                temperature,
+            )
+            outputs = unmarshal_outputs(response or "", len(batch))
+            answers: list[str | None] = [outputs.get(i) for i in range(len(batch))]
+            missing = [i for i, answer in enumerate(answers) if answer is None]
+            retried = await asyncio.gather(
+                *(
+                    self.chat(user_message(batch[i]), max_tokens, temperature)
+                    for i in missing
                 )
+            )
+            for i, answer in zip(missing, retried):
+                answers[i] = answer
+            return answers
+
+        batches = [
+            prompts[i : i + batch_size] for i in range(0, len(prompts), batch_size)
+        ]
+        results = await asyncio.gather(*(chat_batch(batch) for batch in batches))
+        return [answer for answers in results for answer in answers]
 
     async def _chat_stream_under_limit(
         self,
         client: openai.AsyncOpenAI,
         messages: list[dict[str, str]],
+        prompt_tokens: int,
         max_tokens: int | None = None,
         temperature: float | None = None,
         top_p: float | None = None,
-    ) -> str | None:
-        await self.ready_to_go(messages, max_tokens)
-        if self.model_name.startswith("doubao"):
-            extra_body = {
-                "thinking": {
-                    "type": "disabled",
-                }
-            }
-        else:
-            extra_body = {}
+    ) -> StreamedResponse:
+        await self.ready_to_go(prompt_tokens, max_tokens)
         response: openai.AsyncStream[ChatCompletionChunk] = (
             await client.chat.completions.create(
                 model=self.model_name,
@@ -384,16 +650,26 @@ class AsyncAPIInference(AsyncLanguageModelPredictor):
                 temperature=temperature,
                 top_p=top_p,
                 stream=True,
-                extra_body=extra_body,
+                extra_body=self._extra_body,
             )
         )
-        res = ""
+        res: list[str] = []
+        # bound once, as the loop runs for every token
+        append = res.append
+        usage = None
         async for chunk in response:
-            content = chunk.choices[0].delta.content
-            if content is None:
+            if chunk.usage is not None:
+                usage = chunk.usage
+            # the chunk carrying the usage may have no choice
+            choices = chunk.choices
+            if not choices:
                 continue
-            res += content
-        return res
+            content = choices[0].delta.content
+            if content is not None:
+                append(content)
+        token_count = len(res) if usage is None else usage.completion_tokens
+        self.completion_tokens += token_count
+        return StreamedResponse("".join(res), token_count)
 
     async def chat_stream(
         self,
@@ -415,24 +691,42 @@ class AsyncAPIInference(AsyncLanguageModelPredictor):
             A generator of the response from the LLM.
         """
 
-        for client in self.clients:
+        prompt_tokens = self.token_num(messages)
+        clients = self.clients.in_turn()
+        for i, client in enumerate(clients):
 
-            await self.ready_to_go(messages, max_tokens)
+            await self.ready_to_go(prompt_tokens, max_tokens)
 
-            response: openai.AsyncStream[ChatCompletionChunk] = (
-                await client.chat.completions.create(
-                    model=self.model_name,
-                    messages=messages,  # type:ignore
-                    max_completion_tokens=max_tokens,
-                    temperature=temperature,
-                    top_p=top_p,
-                    stream=True,
+            yielded = False
+            try:
+                response: openai.AsyncStream[ChatCompletionChunk] = (
+                    await client.chat.completions.create(
+                        model=self.model_name,
+                        messages=messages,  # type:ignore
+                        max_completion_tokens=max_tokens,
+                        temperature=temperature,
+                        top_p=top_p,
+                        stream=True,
+                    )
                 )
-            )
 
-            async for chunk in response:
-                content = chunk.choices[0].delta.content
-                if content is None:
-                    continue
-                yield content
-            return
+                async for chunk in response:
+                    choices = chunk.choices
+                    if not choices:
+                        continue
+                    content = choices[0].delta.content
+                    if content is None:
+                        continue
+                    yielded = True
+                    yield content
+            except Exception as e:
+                self.clients.report_error(client, e)
+                if not isinstance(e, TRANSIENT_ERRORS + KEY_ERRORS):
+                    raise
+                # the next client starts the response over, which is only
+                # possible if none of it has been delivered yet
+                if yielded or i == len(clients) - 1:
+                    raise
+                logger.error(traceback.format_exc())
+            else:
+                return
@@ -1,3 +1,4 @@
+import asyncio
 from abc import ABC, abstractmethod
 from typing import AsyncGenerator, Dict, Generator, List, Optional, Union
 
@@ -108,6 +109,47 @@ class AsyncLanguageModelPredictor(ABC):
         """
         raise NotImplementedError()
 
+    async def chat_many(
+        self,
+        batch: List[List[Dict[str, str]]],
+        *,
+        max_concurrency: int,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        top_p: Optional[float] = None,
+    ) -> List[Union[str, None, BaseException]]:
+        """
+        Chat with the language model about many independent conversations.
+
+        At most `max_concurrency` of them are in flight at the same time, on
+        top of whatever rate limit `chat` enforces.
+
+        Args:
+            batch: The messages of each conversation.
+            max_concurrency: The maximum number of concurrent chats.
+            max_tokens: The maximum number of tokens in each response, or
+                None for the default of `chat`.
+            temperature: The temperature of the language model.
+            top_p: The top p of the language model.
+
+        Returns:
+            The generated texts, in the order of `batch`; the exception
+            raised by a chat takes the place of its text.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def chat_one(messages: List[Dict[str, str]]) -> Optional[str]:
+            async with semaphore:
+                if max_tokens is None:
+                    return await self.chat(
+                        messages, temperature=temperature, top_p=top_p
+                    )
+                return await self.chat(messages, max_tokens, temperature, top_p)
+
+        return await asyncio.gather(
+            *(chat_one(messages) for messages in batch), return_exceptions=True
+        )
+
     @abstractmethod
     async def chat_stream(
         self,
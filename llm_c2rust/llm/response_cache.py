@@ -0,0 +1,73 @@
+import hashlib
+import os
+import sqlite3
+from collections.abc import Iterator, MutableMapping
+
+from llm_c2rust.llm.uni_tokenizer import serialize_messages
+
+
+class ResponseCache(MutableMapping[str, str]):
+    """
+    A persistent cache of LLM responses, stored in a sqlite database.
+
+    Any other `MutableMapping[str, str]` (a dict, a diskcache.Cache...) can
+    take its place.
+    """
+
+    def __init__(self, path: str):
+        """
+        Open (or create) the cache database.
+
+        Args:
+            path: The path of the sqlite database file.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # autocommit, so every response survives a crash of the run
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT)"
+        )
+
+    @staticmethod
+    def key(
+        model_name: str,
+        temperature: float | None,
+        messages: list[dict[str, str]],
+        max_tokens: int | None = None,
+        attempt: int = 0,
+    ) -> str:
+        canonical = serialize_messages(messages)
+        key = f"{model_name}\0{temperature}\0{max_tokens}\0{canonical}"
+        # retries of a rejected response get keys of their own; the first
+        # attempt keeps the key it always had
+        if attempt:
+            key += f"\0{attempt}"
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def __getitem__(self, key: str) -> str:
+        row = self._db.execute(
+            "SELECT response FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return row[0]
+
+    def __setitem__(self, key: str, response: str) -> None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO responses (key, response) VALUES (?, ?)",
+            (key, response),
+        )
+
+    def __delitem__(self, key: str) -> None:
+        if not self._db.execute("DELETE FROM responses WHERE key = ?", (key,)).rowcount:
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        for (key,) in self._db.execute("SELECT key FROM responses"):
+            yield key
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self) -> None:
+        self._db.close()
@@ -1,3 +1,5 @@
+import functools
+import json
 import logging
 import os
 from typing import Any, Dict, List, Optional, Tuple, Union
@@ -21,57 +23,74 @@ PreTokenizedInputPair = Tuple[List[str], List[str]]
 EncodedInputPair = Tuple[List[int], List[int]]
 
 
+# tiktoken's encode_batch starts a pool of threads per call, which only pays
+# off from this many texts on
+TIKTOKEN_BATCH_MIN = 64
+
+
+# looking an encoding up is not free, and the same few models are counted
+# for every request
+@functools.lru_cache(maxsize=None)
+def openai_encoding(model: str) -> tiktoken.Encoding:
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        logger.warning("Warning: model not found. Using o200k_base encoding.")
+        return tiktoken.get_encoding("o200k_base")
+
+
+# the snapshots whose message overheads are known: 3 tokens per message, and
+# 1 more per name
+PINNED_OPENAI_MODELS = {
+    "gpt-3.5-turbo-0125",
+    "gpt-4-0314",
+    "gpt-4-32k-0314",
+    "gpt-4-0613",
+    "gpt-4-32k-0613",
+    "gpt-4o-mini-2024-07-18",
+    "gpt-4o-2024-08-06",
+}
+# the other models of a family are counted as its snapshot; the most specific
+# family comes first
+OPENAI_MODEL_FAMILIES = (
+    ("gpt-3.5-turbo", "gpt-3.5-turbo-0125"),
+    ("gpt-4o-mini", "gpt-4o-mini-2024-07-18"),
+    ("gpt-4o", "gpt-4o-2024-08-06"),
+    ("gpt-4", "gpt-4-0613"),
+)
+
+
+@functools.lru_cache(maxsize=None)
+def pinned_openai_model(model: str) -> str:
+    """Return the snapshot whose message overheads count for a model."""
+    model = model.lower()
+    if model in PINNED_OPENAI_MODELS:
+        return model
+    for family, pinned in OPENAI_MODEL_FAMILIES:
+        if family in model:
+            logger.warning(
+                f"Warning: {family} may update over time. Returning num tokens assuming {pinned}."
+            )
+            return pinned
+    raise NotImplementedError(
+        f"""openai_num_tokens_from_messages() is not implemented for model {model}."""
+    )
+
+
 def openai_num_tokens_from_messages(
     messages: List[Dict[str, str]], model="gpt-4o-mini-2024-07-18"
 ) -> int:
     """Return the number of tokens used by a list of messages."""
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        logger.warning("Warning: model not found. Using o200k_base encoding.")
-        encoding = tiktoken.get_encoding("o200k_base")
-    if model in {
-        "gpt-3.5-turbo-0125",
-        "gpt-4-0314",
-        "gpt-4-32k-0314",
-        "gpt-4-0613",
-        "gpt-4-32k-0613",
-        "gpt-4o-mini-2024-07-18",
-        "gpt-4o-2024-08-06",
-    }:
-        tokens_per_message = 3
-        tokens_per_name = 1
-    elif "gpt-3.5-turbo" in model:
-        logger.warning(
-            "Warning: gpt-3.5-turbo may update over time. Returning num tokens assuming gpt-3.5-turbo-0125."
-        )
-        return openai_num_tokens_from_messages(messages, model="gpt-3.5-turbo-0125")
-    elif "gpt-4o-mini" in model:
-        logger.warning(
-            "Warning: gpt-4o-mini may update over time. Returning num tokens assuming gpt-4o-mini-2024-07-18."
-        )
-        return openai_num_tokens_from_messages(messages, model="gpt-4o-mini-2024-07-18")
-    elif "gpt-4o" in model:
-        logger.warning(
-            "Warning: gpt-4o and gpt-4o-mini may update over time. Returning num tokens assuming gpt-4o-2024-08-06."
-        )
-        return openai_num_tokens_from_messages(messages, model="gpt-4o-2024-08-06")
-    elif "gpt-4" in model:
-        logger.warning(
-            "Warning: gpt-4 may update over time. Returning num tokens assuming gpt-4-0613."
-        )
-        return openai_num_tokens_from_messages(messages, model="gpt-4-0613")
-    else:
-        raise NotImplementedError(
-            f"""openai_num_tokens_from_messages() is not implemented for model {model}."""
-        )
-    num_tokens = 0
-    for message in messages:
-        num_tokens += tokens_per_message
-        for key, value in message.items():
-            num_tokens += len(encoding.encode(value))
-            if key == "name":
-                num_tokens += tokens_per_name
+    encoding = openai_encoding(pinned_openai_model(model))
+    tokens_per_message = 3
+    tokens_per_name = 1
+    num_tokens = sum(
+        len(encoding.encode(value))
+        for message in messages
+        for value in message.values()
+    )
+    num_tokens += tokens_per_message * len(messages)
+    num_tokens += tokens_per_name * sum("name" in message for message in messages)
     num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
     return num_tokens
 
@@ -110,40 +129,94 @@ DEEPSEEK_MODELS = [
 ]
 
 
+# loading a tokenizer is slow, and every engine and predicator of a run
+# asks for the tokenizer of the same model
+@functools.lru_cache(maxsize=None)
+def load_tokenizer(model: str) -> Any:
+    if not os.path.exists(model):
+        if model.lower() in OPENAI_MODELS:
+            return tiktoken.encoding_for_model(model)
+        elif model.lower() in DEEPSEEK_MODELS:
+            return transformers.AutoTokenizer.from_pretrained(
+                "deepseek-ai/DeepSeek-V2-Lite",
+                revison="604d5664dddd88a0433dbae533b7fe9472482de0",
+            )
+        elif (
+            "qwen-max" in model.lower()
+            or "qwen-plus" in model.lower()
+            or "qwen2" in model.lower()
+        ):
+            return transformers.AutoTokenizer.from_pretrained(
+                "Qwen/Qwen2-7B-Instruct",
+                revison="f2826a00ceef68f0f2b946d945ecc0477ce4450c",
+            )
+        elif "qwen2.5" in model.lower():
+            return transformers.AutoTokenizer.from_pretrained(
+                "Qwen/Qwen2.5-7B-Instruct",
+                revison="bb46c15ee4bb56c5b63245ef50fd7637234d6f75",
+            )
+        elif "qwen2.5-coder" in model.lower():
+            return transformers.AutoTokenizer.from_pretrained(
+                "Qwen/Qwen2.5-Coder-7B-Instruct",
+                revison="7b148ce7a59a361780846419d31d271537addf81",
+            )
+        else:
+            return transformers.AutoTokenizer.from_pretrained(model)
+    else:
+        return transformers.AutoTokenizer.from_pretrained(model)
+
+
+# a fast Hugging Face tokenizer wraps a Rust tokenizer of the `tokenizers`
+# library; counting with it directly skips the Python layers of `transformers`
+# and adds the same special tokens
+@functools.lru_cache(maxsize=None)
+def rust_tokenizer(model: str) -> Any:
+    tokenizer = load_tokenizer(model)
+    if getattr(tokenizer, "is_fast", False):
+        return tokenizer.backend_tokenizer
+    return None
+
+
+def _encoded_len(model: str, text: str) -> int:
+    if (backend := rust_tokenizer(model)) is not None:
+        return len(backend.encode(text))
+    return len(load_tokenizer(model).encode(text))
+
+
+# the same texts (segments, signatures, prompts) are counted over and over
+@functools.lru_cache(maxsize=1024)
+def text_token_num(model: str, text: str) -> int:
+    return _encoded_len(model, text)
+
+
+def serialize_messages(messages: List[Dict[str, str]]) -> str:
+    """
+    Return the canonical JSON of a list of messages.
+    """
+    return json.dumps(messages, sort_keys=True, separators=(",", ":"))
+
+
+# a prompt is counted by its serialization, once, however many times it is
+# sent again (retries, fallback clients, repeated requests)
+@functools.lru_cache(maxsize=256)
+def messages_token_num(model: str, serialized: str) -> int:
+    messages = json.loads(serialized)
+    tokenizer = load_tokenizer(model)
+    if isinstance(tokenizer, tiktoken.Encoding):
+        return openai_num_tokens_from_messages(messages, model)
+    elif isinstance(tokenizer, transformers.PreTrainedTokenizerBase):
+        text_final = tokenizer.apply_chat_template(
+            messages, tokenize=False, add_generation_prompt=True
+        )
+        return _encoded_len(model, text_final)  # type: ignore
+    else:
+        raise Exception("Invalid tokenizer")
+
+
 class UniTokenizer(object):
     def __init__(self, model: str) -> None:
         self.model = model
-        if not os.path.exists(model):
-            if self.model.lower() in OPENAI_MODELS:
-                self.tokenizer = tiktoken.encoding_for_model(self.model)
-            elif self.model.lower() in DEEPSEEK_MODELS:
-                self.tokenizer = transformers.AutoTokenizer.from_pretrained(
-                    "deepseek-ai/DeepSeek-V2-Lite",
-                    revison="604d5664dddd88a0433dbae533b7fe9472482de0",
-                )
-            elif (
-                "qwen-max" in self.model.lower()
-                or "qwen-plus" in self.model.lower()
-                or "qwen2" in self.model.lower()
-            ):
-                self.tokenizer = transformers.AutoTokenizer.from_pretrained(
-                    "Qwen/Qwen2-7B-Instruct",
-                    revison="f2826a00ceef68f0f2b946d945ecc0477ce4450c",
-                )
-            elif "qwen2.5" in self.model.lower():
-                self.tokenizer = transformers.AutoTokenizer.from_pretrained(
-                    "Qwen/Qwen2.5-7B-Instruct",
-                    revison="bb46c15ee4bb56c5b63245ef50fd7637234d6f75",
-                )
-            elif "qwen2.5-coder" in self.model.lower():
-                self.tokenizer = transformers.AutoTokenizer.from_pretrained(
-                    "Qwen/Qwen2.5-Coder-7B-Instruct",
-                    revison="7b148ce7a59a361780846419d31d271537addf81",
-                )
-            else:
-                self.tokenizer = transformers.AutoTokenizer.from_pretrained(self.model)
-        else:
-            self.tokenizer = transformers.AutoTokenizer.from_pretrained(self.model)
+        self.tokenizer = load_tokenizer(model)
 
     def token_num(self, text: Union[str, List[Dict[str, str]]]) -> int:
         """
@@ -155,27 +228,32 @@ class UniTokenizer(object):
         Returns:
             The number of tokens in the text.
         """
+        if isinstance(text, str):
+            return text_token_num(self.model, text)
+        if isinstance(text, list):
+            return messages_token_num(self.model, serialize_messages(text))
+        raise TypeError("Input text must be either a string or a list of dictionaries.")
+
+    def token_nums(self, texts: List[str]) -> List[int]:
+        """
+        Return the number of tokens in each text, encoding all of them in one batch.
+
+        Args:
+            texts: The texts to count the tokens of.
+
+        Returns:
+            The number of tokens in each text.
+        """
+        if not texts:
+            return []
         if isinstance(self.tokenizer, tiktoken.Encoding):
-            if not isinstance(text, str):
-                num = openai_num_tokens_from_messages(text, self.model)
-            else:
-                model_inputs = self.tokenizer.encode(text)
-                num = len(model_inputs)
-            return num
+            if len(texts) < TIKTOKEN_BATCH_MIN:
+                return [len(self.tokenizer.encode(text)) for text in texts]
+            return [len(ids) for ids in self.tokenizer.encode_batch(texts)]
+        elif (backend := rust_tokenizer(self.model)) is not None:
+            return [len(encoding) for encoding in backend.encode_batch(texts)]
         elif isinstance(self.tokenizer, transformers.PreTrainedTokenizerBase):
-            if isinstance(text, list):
-                text_final = self.tokenizer.apply_chat_template(
-                    text, tokenize=False, add_generation_prompt=True
-                )
-            elif isinstance(text, str):
-                text_final = text
-            else:
-                raise TypeError(
-                    "Input text must be either a string or a list of dictionaries."
-                )
-
-            model_inputs = self.tokenizer.encode(text_final)  # type: ignore
-            return len(model_inputs)
+            return [len(ids) for ids in self.tokenizer(texts)["input_ids"]]
         else:
             raise Exception("Invalid tokenizer")
 
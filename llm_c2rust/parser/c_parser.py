@@ -4,35 +4,35 @@ from typing import List, Tuple
 import os
 
 import tree_sitter_c as tsc
-from tree_sitter import Language, Parser, Node, Tree
-from .tree_sitter_utils import has_error
+from tree_sitter import Language, Node, Tree
+from .tree_sitter_utils import ThreadLocalParser
 
-def check_grammar(c_code: str) -> bool:
+C_LANGUAGE = Language(tsc.language())
+_parser = ThreadLocalParser(C_LANGUAGE)
+
+def check_grammar(c_code: str | bytes) -> bool:
     """
     Check if the provided C code has syntax errors using the tree-sitter C parser.
 
     :param c_code: The C code to be checked for grammar errors.
-    :type c_code: str
+    :type c_code: str | bytes
 
     :return: True if there are syntax errors in the code, False otherwise.
     :rtype: bool
     """
-    C_LANGUAGE = Language(tsc.language())
-    parser = Parser(C_LANGUAGE)
-    tree = parser.parse(c_code.encode(), encoding="utf8")
-    return has_error(tree.root_node)
+    tree = _parser.parse(c_code)
+    # computed by tree-sitter while parsing, ERROR and MISSING nodes alike
+    return tree.root_node.has_error
 
-def parse_c(c_code: str) -> Tree:
+def parse_c(c_code: str | bytes) -> Tree:
     """
     Parse the provided C code into an abstract syntax tree (AST).
 
     :param c_code: The C code to be parsed.
-    :type c_code: str
+    :type c_code: str | bytes
 
     :return: The abstract syntax tree representing the parsed C code.
     :rtype: Tree
     """
-    C_LANGUAGE = Language(tsc.language())
-    parser = Parser(C_LANGUAGE)
-    tree = parser.parse(c_code.encode(), encoding="utf8")
+    tree = _parser.parse(c_code)
     return tree
@@ -4,18 +4,17 @@ from typing import List, Tuple
 import os
 
 import tree_sitter_cpp as tscpp
-from tree_sitter import Language, Parser, Node, Tree
-from .tree_sitter_utils import has_error
+from tree_sitter import Language, Node, Tree
+from .tree_sitter_utils import ThreadLocalParser
 
-def check_grammar(cpp_code: str) -> bool:
-    CPP_LANGUAGE = Language(tscpp.language())
-    parser = Parser(CPP_LANGUAGE)
-    tree = parser.parse(cpp_code.encode(), encoding="utf8")
-    return has_error(tree.root_node)
+CPP_LANGUAGE = Language(tscpp.language())
+_parser = ThreadLocalParser(CPP_LANGUAGE)
 
-def parse_cpp(cpp_code: str) -> Tree:
-    CPP_LANGUAGE = Language(tscpp.language())
-    parser = Parser(CPP_LANGUAGE)
-    tree = parser.parse(cpp_code.encode(), encoding="utf8")
+def check_grammar(cpp_code: str | bytes) -> bool:
+    tree = _parser.parse(cpp_code)
+    return tree.root_node.has_error
+
+def parse_cpp(cpp_code: str | bytes) -> Tree:
+    tree = _parser.parse(cpp_code)
     return tree
 
@@ -1,16 +1,36 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
 import tree_sitter_rust as tsrust
-from tree_sitter import Language, Parser, Tree
+from tree_sitter import Language, Tree
+
+from .tree_sitter_utils import ThreadLocalParser
+
+RUST_LANGUAGE = Language(tsrust.language())
+_parser = ThreadLocalParser(RUST_LANGUAGE)
+
+GRAMMAR_CACHE_SIZE = 4096
+# keyed by a digest, so that whole responses are not kept alive; oldest first
+_grammar_cache: OrderedDict[bytes, bool] = OrderedDict()
+_grammar_lock = threading.Lock()
 
 
 def grammar_correct(rust_code: str) -> bool:
-    RUST_LANGUAGE = Language(tsrust.language())
-    parser = Parser(RUST_LANGUAGE)
-    tree = parser.parse(rust_code.encode(), encoding="utf8")
-    return not tree.root_node.has_error
+    code = rust_code.encode()
+    digest = hashlib.blake2b(code, digest_size=16).digest()
+    with _grammar_lock:
+        if digest in _grammar_cache:
+            _grammar_cache.move_to_end(digest)
+            return _grammar_cache[digest]
+    correct = not _parser.parse(code).root_node.has_error
+    with _grammar_lock:
+        _grammar_cache[digest] = correct
+        if len(_grammar_cache) > GRAMMAR_CACHE_SIZE:
+            _grammar_cache.popitem(last=False)
+    return correct
 
 
-def parse_rust(rust_code: str) -> Tree:
-    RUST_LANGUAGE = Language(tsrust.language())
-    parser = Parser(RUST_LANGUAGE)
-    tree = parser.parse(rust_code.encode(), encoding="utf8")
+def parse_rust(rust_code: str | bytes) -> Tree:
+    tree = _parser.parse(rust_code)
     return tree
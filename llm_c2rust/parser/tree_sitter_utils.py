@@ -1,10 +1,33 @@
-from tree_sitter import Node
+import threading
+
+from tree_sitter import Language, Node, Parser, Tree
+
+
+class ThreadLocalParser(threading.local):
+    """
+    A parser of a language, created once per thread: a tree-sitter parser is
+    costly to set up, and cannot be used by two threads at once.
+    """
+
+    def __init__(self, language: Language) -> None:
+        self.parser = Parser(language)
+
+    def parse(self, code: str | bytes) -> Tree:
+        # bytes, e.g. read from a file, are parsed without a copy
+        if isinstance(code, str):
+            code = code.encode()
+        return self.parser.parse(code, encoding="utf8")
 
 
 def has_error(node: Node) -> bool:
-    if node.type == "ERROR":
-        return True
-    return any(has_error(child) for child in node.children)
+    # iterative, as the trees of large files are deep
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node.type == "ERROR":
+            return True
+        stack.extend(node.children)
+    return False
 
 
 def has_named_child(node: Node, name: str) -> bool:
@@ -15,6 +15,7 @@ class Endpoint(BaseModel):
     api_type: Literal["chat", "embedding"] = "chat"
     max_tokens: int = 8192
     reasoning: bool = False
+    max_attempts: int | None = None
 
 
 class Config(BaseModel):
@@ -23,3 +24,4 @@ class Config(BaseModel):
     token_num_method: str = "deepseek-chat"
     max_resolve_round: int = 5
     max_retry: int = 2
+    max_concurrency: int = 16
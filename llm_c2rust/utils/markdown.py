@@ -1,6 +1,9 @@
 import re
 from typing import List, Tuple
 
+_CODE_BLOCK = re.compile(r"```[a-zA-Z]*\n([\s\S]*?)\n```")
+_FENCE = re.compile(r"\s*```([a-zA-Z]*)$")
+
 
 def extract_code_blocks(markdown_string: str) -> List[str]:
     """
@@ -12,8 +15,7 @@ def extract_code_blocks(markdown_string: str) -> List[str]:
     Returns:
         A list of code blocks from the markdown string.
     """
-    pattern = r"```[a-zA-Z]*\n([\s\S]*?)\n```"
-    matches = re.findall(pattern, markdown_string)
+    matches = _CODE_BLOCK.findall(markdown_string)
     return [match.strip() for match in matches]
 
 
@@ -28,21 +30,22 @@ def extract_code_blocks_with_language(markdown_string: str) -> List[Tuple[str, s
         A list of code blocks with language from the markdown string.
     """
     code_blocks = []
-    block = None
+    block: List[str] | None = None
     lang = None
     for line in markdown_string.splitlines():
-        if m := re.match(r"\s*```([a-zA-Z]*)$", line):
+        # only lines containing a fence can match, skip the regex for the rest
+        if "```" in line and (m := _FENCE.match(line)):
             if block is not None:
-                code_blocks.append((lang, block))
+                code_blocks.append((lang, "".join(block)))
                 block = None
                 lang = None
             else:
                 lang = m.group(1)
-                block = ""
+                block = []
         else:
             if block is not None:
-                block += line + "\n"
+                block.append(line + "\n")
     # append the last partial block
     if block is not None:
-        code_blocks.append((lang, block))
+        code_blocks.append((lang, "".join(block)))
     return code_blocks